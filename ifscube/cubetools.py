@@ -12,6 +12,7 @@ from astropy import table
 from astropy.io import fits
 from numpy import interp, ma
 from scipy.integrate import trapz
+from scipy.ndimage import distance_transform_edt
 
 
 def peak_spaxel(cube):
@@ -66,6 +67,38 @@ def nan_to_nearest(d):
     return g.reshape(d.shape)
 
 
+def nan_to_nearest_cube(d):
+    """
+    Replaces nan values of a data cube with the value of the nearest
+    pixel within the same wavelength slice.
+
+    Parameters
+    ----------
+    d: numpy.ndarray
+      Data cube with the wavelength in the first dimension.
+
+    Returns
+    -------
+    g: numpy.ndarray
+      Output data cube.
+
+    Notes
+    -----
+    This is the vectorized equivalent of applying nan_to_nearest to
+    each image of the cube, with the nearest-pixel search performed
+    by scipy.ndimage.distance_transform_edt instead of a per-pixel
+    Python loop.
+    """
+    g = np.array(d, dtype=float)
+    bad = np.isnan(g)
+
+    for i in np.nonzero(bad.any(axis=(1, 2)))[0]:
+        nearest = distance_transform_edt(bad[i], return_distances=False, return_indices=True)
+        g[i] = g[i][tuple(nearest)]
+
+    return g
+
+
 class NanSolution:
 
     def __init__(self):
@@ -74,9 +107,9 @@ class NanSolution:
         self.bestfit = None
 
     def ppxf(self, sol, galaxy):
-        self.sol = np.array([np.nan for _ in range(len(sol))])
-        self.galaxy = np.array([np.nan for _ in range(len(galaxy))])
-        self.bestfit = np.array([np.nan for _ in range(len(galaxy))])
+        self.sol = np.full(len(sol), np.nan)
+        self.galaxy = np.full(len(galaxy), np.nan)
+        self.bestfit = np.full(len(galaxy), np.nan)
 
 
 def wlprojection(arr, wl, wl0, fwhm=10, filtertype='box'):
@@ -146,8 +179,15 @@ def wlprojection(arr, wl, wl0, fwhm=10, filtertype='box'):
     return outim
 
 
-def bound_updater(p0, bound_range, bounds=None):
-    newbound = []
+def bound_updater(p0, bound_range, bounds=None, out=None):
+    # When a buffer from a previous call is given via *out* it is
+    # updated in place, so callers that evaluate new bounds for every
+    # spaxel do not rebuild the whole structure each time.
+    if out is None:
+        newbound = [[None, None] for _ in range(len(p0))]
+    else:
+        newbound = out
+
     if np.shape(bound_range) != ():
         npars = len(bound_range)
 
@@ -155,65 +195,69 @@ def bound_updater(p0, bound_range, bounds=None):
             for i in range(0, len(p0), npars):
                 for j in range(npars):
                     if bound_range[j]['type'] == 'factor':
-                        newbound += [
-                            [p0[i + j] * (1. - bound_range[j]['value']),
-                             p0[i + j] * (1. + bound_range[j]['value'])]]
-                        if newbound[-1][1] < newbound[-1][0]:
-                            newbound[-1].sort()
-                    if bound_range[j]['type'] == 'add':
-                        newbound += [
-                            [p0[i + j] - bound_range[j]['value'],
-                             p0[i + j] + bound_range[j]['value']]]
-                    if bound_range[j]['type'] == 'hard':
-                        newbound += [
-                            [- bound_range[j]['value'],
-                             + bound_range[j]['value']]]
+                        low = p0[i + j] * (1. - bound_range[j]['value'])
+                        high = p0[i + j] * (1. + bound_range[j]['value'])
+                        if high < low:
+                            low, high = high, low
+                    elif bound_range[j]['type'] == 'add':
+                        low = p0[i + j] - bound_range[j]['value']
+                        high = p0[i + j] + bound_range[j]['value']
+                    elif bound_range[j]['type'] == 'hard':
+                        low = - bound_range[j]['value']
+                        high = + bound_range[j]['value']
+                    else:
+                        raise ValueError('Unknown bound range type "{:s}".'.format(bound_range[j]['type']))
+                    newbound[i + j][0] = low
+                    newbound[i + j][1] = high
 
         else:
             for i in range(0, len(p0), npars):
                 for j in range(npars):
-                    newbound += [
-                        [p0[i + j] - bound_range[j],
-                         p0[i + j] + bound_range[j]]]
+                    newbound[i + j][0] = p0[i + j] - bound_range[j]
+                    newbound[i + j][1] = p0[i + j] + bound_range[j]
     else:
 
-        for i in p0:
-            if i == 0:
-                newbound += [[i - bound_range, i + bound_range]]
+        for i, value in enumerate(p0):
+            if value == 0:
+                low, high = value - bound_range, value + bound_range
             else:
-                newbound += [[i * (1. - bound_range), i * (1. + bound_range)]]
-                if newbound[-1][1] < newbound[-1][0]:
-                    newbound[-1].sort()
+                low, high = value * (1. - bound_range), value * (1. + bound_range)
+                if high < low:
+                    low, high = high, low
+            newbound[i][0] = low
+            newbound[i][1] = high
 
     # If bounds is set, then newbounds must not exceed bounds.
     if bounds is not None:
-        for i, j in enumerate(newbound):
+        for i, (low_new, high_new) in enumerate(newbound):
 
-            low_new, high_new = j
             low, high = bounds[i]
             d = abs(high_new - low_new)
 
             if low is not None:
                 if low_new < low:
-                    low_new = copy.deepcopy(low)
+                    low_new = low
                     high_new = low_new + d
             else:
                 low_new = None
 
             if high is not None:
                 if high_new > high:
-                    high_new = copy.deepcopy(high)
+                    high_new = high
                     low_new = high_new - d
             else:
                 high_new = None
 
-            newbound[i] = [low_new, high_new]
+            newbound[i][0] = low_new
+            newbound[i][1] = high_new
 
     return newbound
 
 
 def scale_bounds(bounds, flux_sf):
-    b = copy.deepcopy(bounds)
+    # Fresh [low, high] pairs instead of a recursive deepcopy; the
+    # input is only read here.
+    b = [list(j) for j in bounds]
     for i, j in enumerate(b):
         for k in (0, 1):
             if j[k] is not None:
@@ -240,6 +284,18 @@ def rebin(arr, xbin, ybin, combine='sum', mask=None):
     else:
         data = ma.array(data=arr)
 
+    if (old_shape[1] % ybin == 0) and (old_shape[2] % xbin == 0):
+        # When the spatial dimensions are exact multiples of the bin
+        # sizes, the whole rebinning reduces to a single reshape
+        # followed by a reduction over the bin axes, avoiding the
+        # per-bin python loop below.
+        blocks = data.reshape(old_shape[0], new_shape[1], ybin, new_shape[2], xbin)
+        if combine == 'sum':
+            new[:] = blocks.sum(axis=(2, 4)).filled(0.0)
+        else:
+            new[:] = blocks.mean(axis=(2, 4)).filled(0.0)
+        return new
+
     def comb_sum(x, m, n):
         return x[:, m * ybin:(m + 1) * ybin, n * xbin:(n + 1) * xbin].sum(axis=(1, 2))
 
@@ -359,5 +415,7 @@ def resample_stellar(binned, original, normalization_wavelength=5500, span=30):
         original.stellar[:, i, j] = interp(original.rest_wavelength, binned.rest_wavelength, new_stellar[:, i, j],
                                            left=np.nan, right=np.nan)
 
-    original.flags |= np.isnan(original.stellar)
+    # Plain assignment instead of |=, since the flags cube may be a
+    # read-only constant broadcast when no flags were loaded.
+    original.flags = original.flags | np.isnan(original.stellar)
     return original
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from typing import Union, Iterable
 
@@ -21,63 +22,180 @@ class Cube:
     A class for dealing with IFS data cubes.
     """
 
+    # Default values for attributes set at initialization. Keeping the
+    # inventory at class level avoids a long list of individual
+    # assignments in __init__ and documents the instance attributes in
+    # a single place.
+    _defaults = {
+        'binned': False,
+        'binned_cube': None,
+        'component_names': None,
+        'cont': None,
+        'data': None,
+        'em_model': None,
+        'eqw_direct': None,
+        'eqw_model': None,
+        'feature_wl': None,
+        'fit_func': None,
+        'fit_info': None,
+        'fit_status': None,
+        'fit_wavelength': None,
+        'fit_x0': None,
+        'fit_y0': None,
+        'fitbounds': None,
+        'fitcont': None,
+        'fitspec': None,
+        'fitstellar': None,
+        'fitweights': None,
+        'flux_direct': None,
+        'flux_model': None,
+        'flags': None,
+        'header': None,
+        'initial_guess': None,
+        'ncubes': None,
+        'noise': None,
+        'noise_cube': None,
+        'npars': None,
+        'parnames': None,
+        'ppxf_sol': None,
+        'resultspec': None,
+        'signal': None,
+        'spatial_mask': None,
+        'spec_indices': None,
+        'stellar': None,
+        'variance': None,
+        'weights': None,
+        '_window_cache': None,
+        '_spatial_grid': None,
+        '_fit_file': None,
+        '_vor_hdus': None,
+        '_has_variance': False,
+        '_has_flags': False,
+        '_has_stellar': False,
+        '_has_weights': False,
+    }
+
     def __init__(self, *args, **kwargs):
         """
         Instantiates the class. If any arguments are given they will be
         passed to the _load method.
         """
 
-        self.binned = False
-        self.binned_cube = None
-        self.component_names = None
-        self.cont = None
-        self.data = None
-        self.em_model = None
-        self.eqw_direct = None
-        self.eqw_model = None
-        self.feature_wl = None
-        self.fit_func = None
-        self.fit_info = None
-        self.fit_status = None
-        self.fit_wavelength = None
-        self.fit_x0 = None
-        self.fit_y0 = None
-        self.fitbounds = None
-        self.fitcont = None
-        self.fitspec = None
-        self.fitstellar = None
-        self.fitweights = None
-        self.flux_direct = None
-        self.flux_model = None
-        self.flags = None
-        self.header = None
-        self.initial_guess = None
-        self.ncubes = None
-        self.noise = None
-        self.noise_cube = None
-        self.npars = None
-        self.parnames = None
-        self.ppxf_sol = None
-        self.resultspec = None
-        self.signal = None
-        self.spatial_mask = None
-        self.spec_indices = None
-        self.variance = None
+        for key, value in self._defaults.items():
+            setattr(self, key, value)
 
         if len(args) > 0:
             self._load(*args, **kwargs)
 
+    def _default_accessory(self, value, dtype=None):
+        """Builds a read-only constant cube matching the data shape."""
+        if self.data is None:
+            return None
+        if dtype is None:
+            dtype = self.data.dtype
+        return np.broadcast_to(np.array(value, dtype=dtype), self.data.shape)
+
+    def _wavelength_fingerprint(self):
+        """
+        Returns a tuple identifying the current wavelength scale, used
+        to key the window cache so that entries computed for a
+        previous rest_wavelength are never reused after the attribute
+        is reassigned.
+        """
+        wl = self.rest_wavelength
+        return float(wl[0]), float(wl[-1]), len(wl)
+
+    def _window_mask(self, wl_range, inclusive=False):
+        """
+        Returns a boolean mask over rest_wavelength for the given
+        wavelength window, caching the result since the same window is
+        typically used across many method calls. The cache is reset
+        whenever a new cube is loaded.
+        """
+        if self._window_cache is None:
+            self._window_cache = {}
+        key = (self._wavelength_fingerprint(), float(wl_range[0]), float(wl_range[1]), inclusive)
+        mask = self._window_cache.get(key)
+        if mask is None:
+            if inclusive:
+                mask = (self.rest_wavelength >= wl_range[0]) & (self.rest_wavelength <= wl_range[1])
+            else:
+                mask = (self.rest_wavelength > wl_range[0]) & (self.rest_wavelength < wl_range[1])
+            self._window_cache[key] = mask
+        return mask
+
+    def _window_slice(self, wl_range, inclusive=False):
+        """
+        Same as _window_mask, but returns a slice object instead of a
+        boolean mask. Since rest_wavelength is monotonically
+        ascending, the window is always a contiguous run, and slicing
+        the data cube with it yields a view instead of a copy.
+        """
+        if self._window_cache is None:
+            self._window_cache = {}
+        key = ('slice', self._wavelength_fingerprint(), float(wl_range[0]), float(wl_range[1]), inclusive)
+        window = self._window_cache.get(key)
+        if window is None:
+            if inclusive:
+                lo = np.searchsorted(self.rest_wavelength, wl_range[0], side='left')
+                hi = np.searchsorted(self.rest_wavelength, wl_range[1], side='right')
+            else:
+                lo = np.searchsorted(self.rest_wavelength, wl_range[0], side='right')
+                hi = np.searchsorted(self.rest_wavelength, wl_range[1], side='left')
+            window = slice(lo, hi)
+            self._window_cache[key] = window
+        return window
+
+    @property
+    def variance(self):
+        if self._variance is None:
+            return self._default_accessory(1.0)
+        return self._variance
+
+    @variance.setter
+    def variance(self, value):
+        self._variance = value
+        self._has_variance = value is not None
+
+    @property
+    def flags(self):
+        if self._flags is None:
+            return self._default_accessory(False, dtype=bool)
+        return self._flags
+
+    @flags.setter
+    def flags(self, value):
+        self._flags = value
+        self._has_flags = value is not None
+
+    @property
+    def stellar(self):
+        if self._stellar is None:
+            return self._default_accessory(0.0)
+        return self._stellar
+
+    @stellar.setter
+    def stellar(self, value):
+        self._stellar = value
+        self._has_stellar = value is not None
+
+    @property
+    def weights(self):
+        if self._weights is None:
+            return self._default_accessory(1.0)
+        return self._weights
+
+    @weights.setter
+    def weights(self, value):
+        self._weights = value
+        self._has_weights = value is not None
+
     def _accessory_data(self, hdu, variance, flags, stellar, weights, spatial_mask):
 
         def shmess(name):
             s = '{:s} spectrum must have the same shape of the spectrum itself'
             return s.format(name)
 
-        self.variance = np.ones_like(self.data)
-        self.flags = np.zeros_like(self.data)
-        self.stellar = np.zeros_like(self.data)
-        self.weights = np.ones_like(self.data)
-
         if spatial_mask is not None:
             assert hdu[spatial_mask].data.shape == self.data.shape[1:], \
                 'Spatial mask must match the last two dimensions of the data cube.'
@@ -85,21 +203,29 @@ class Cube:
         else:
             self.spatial_mask = np.zeros(self.data.shape[1:]).astype('bool')
 
-        acc_data = [self.variance, self.flags, self.stellar, self.weights]
         ext_names = [variance, flags, stellar, weights]
         labels = ['Variance', 'Flags', 'Synthetic', 'Weights']
+        attributes = ['variance', 'flags', 'stellar', 'weights']
 
-        for i, j, lab in zip(acc_data, ext_names, labels):
+        for j, lab, attribute in zip(ext_names, labels, attributes):
 
+            data = None
             if j is not None:
                 if isinstance(j, str):
                     if j in hdu:
                         assert hdu[j].data.shape == self.data.shape, shmess(lab)
-                        i[:] = hdu[j].data
+                        data = np.array(hdu[j].data)
                 elif isinstance(j, np.ndarray):
-                    i[:] = j
+                    data = np.array(j)
+
+            if (data is not None) and (attribute == 'flags'):
+                data = data.astype(bool)
 
-        self.flags = self.flags.astype(bool)
+            # Cubes for which no data was provided are left as None,
+            # and materialized as read-only constant broadcasts by the
+            # respective property getters. The setters keep the
+            # _has_* presence flags in sync.
+            setattr(self, attribute, data)
 
     def _load(self, fname, scidata='SCI', primary='PRIMARY', variance=None, flags=None, stellar=None, weights=None,
               redshift=None, vortab=None, nan_spaxels='all', spatial_mask=None, spectral_dimension=3):
@@ -146,25 +272,50 @@ class Cube:
         for key in exts:
             self.extension_names[key] = locals()[key]
 
-        with fits.open(fname) as hdu:
+        with fits.open(fname, memmap=True, lazy_load_hdus=True) as hdu:
             self.data = hdu[scidata].data
             self.header = hdu[primary].header
             self.header_data = hdu[scidata].header
             self.wcs = wcs.WCS(self.header_data)
 
             self._accessory_data(hdu, variance, flags, stellar, weights, spatial_mask)
-            self.noise_cube = np.sqrt(self.variance)
-            self.noise_cube[self.flags] = 0.0
-
-        if nan_spaxels == 'all':
-            self.nan_mask = np.isnan(self.data).all(axis=0) | np.isnan(self.stellar).all(axis=0)
-        elif nan_spaxels == 'any':
-            self.nan_mask = np.isnan(self.data).any(axis=0) | np.isnan(self.stellar).any(axis=0)
+            if self._has_variance or self._has_flags:
+                self.noise_cube = np.sqrt(self.variance)
+                self.noise_cube[self.flags] = 0.0
+            else:
+                self.noise_cube = self._default_accessory(1.0)
+
+            # Keeps copies of the Voronoi binning extensions, so that
+            # writing the fit results does not require re-opening and
+            # re-parsing the input file.
+            self._vor_hdus = [hdu[name].copy() for name in ['VOR', 'VORPLUS'] if name in hdu]
+
+        if nan_spaxels in ('all', 'any'):
+            reduction = np.all if nan_spaxels == 'all' else np.any
+            # Reuses a single boolean buffer for the NaN scans, and
+            # skips the stellar pass when no stellar extension was
+            # loaded, since the default stellar cube has no NaNs.
+            nan_cube = np.isnan(self.data)
+            self.nan_mask = reduction(nan_cube, axis=0)
+            if self._has_stellar:
+                np.isnan(self.stellar, out=nan_cube)
+                self.nan_mask |= reduction(nan_cube, axis=0)
         else:
             self.nan_mask = np.zeros(self.data.shape[1:]).astype('bool')
         self.spatial_mask |= self.nan_mask
 
-        self.wl = self.wcs.sub((spectral_dimension,)).wcs_pix2world(np.arange(len(self.data)), 0)[0]
+        spectral_wcs = self.wcs.sub((spectral_dimension,))
+        linear_spectral_axis = ('-' not in spectral_wcs.wcs.ctype[0]) and (spectral_wcs.sip is None) \
+            and (spectral_wcs.cpdis1 is None) and (spectral_wcs.cpdis2 is None)
+        if linear_spectral_axis:
+            # For a purely linear spectral axis the wcslib call reduces
+            # to a first degree polynomial of the pixel coordinates.
+            crval = spectral_wcs.wcs.crval[0]
+            crpix = spectral_wcs.wcs.crpix[0]
+            cdelt = spectral_wcs.pixel_scale_matrix[0, 0]
+            self.wl = crval + cdelt * (np.arange(len(self.data), dtype=np.float64) + 1.0 - crpix)
+        else:
+            self.wl = spectral_wcs.wcs_pix2world(np.arange(len(self.data)), 0)[0]
 
         if self.wcs.wcs.cunit[2] == units.m:
             self.wl *= 1e+10
@@ -177,6 +328,7 @@ class Cube:
             self.redshift = 0
 
         self.rest_wavelength = onedspec.Spectrum.dopcor(self.redshift, self.wl)
+        self._window_cache = {}
 
         try:
             if self.header['VORBIN']:
@@ -190,32 +342,41 @@ class Cube:
         self.cont = None
 
     def _set_spec_indices(self):
-        self.spec_indices = np.column_stack([
-            np.ravel(np.indices(np.shape(self.data)[1:])[0][~self.spatial_mask]),
-            np.ravel(np.indices(np.shape(self.data)[1:])[1][~self.spatial_mask]),
-        ])
+        rows, cols = np.nonzero(np.logical_not(self.spatial_mask))
+        self.spec_indices = np.ascontiguousarray(np.column_stack((rows, cols)), dtype=np.int32)
+
+    def _index_grids(self):
+        """Returns cached (yy, xx) index grids for the spatial dimensions."""
+        if (self._spatial_grid is None) or (self._spatial_grid.shape[1:] != self.data.shape[1:]):
+            self._spatial_grid = np.indices(self.data.shape[1:], dtype=np.int32)
+        return self._spatial_grid
 
     def _arg2cube(self, arg, cube):
 
         if len(np.shape(arg)) == 0:
             cube *= arg
         elif len(np.shape(arg)) == 1:
-            for i, j in self.spec_indices:
-                cube[:, i, j] = arg
+            cube[:, ~self.spatial_mask] = np.asarray(arg)[:, np.newaxis]
         elif len(np.shape(arg)) == 2:
-            for i, j in enumerate(cube):
-                cube[i] = arg
+            cube[:] = np.asarray(arg)[np.newaxis, :, :]
 
         return cube
 
+    def _broadcast_arg(self, arg):
+        """Expands a scalar, spectrum or image argument to the cube
+        shape as a read-only broadcast view."""
+        arg = np.asarray(arg)
+        if arg.ndim == 1:
+            arg = arg[:, np.newaxis, np.newaxis]
+        return np.broadcast_to(arg, self.data.shape)
+
     def _fit_table(self):
 
         cnames = self.component_names
         pnames = self.parnames
 
-        # TODO: Change this to make the array based on the lengths of cnames and pnames.
-        c = np.array([[i for _ in pnames] for i in cnames]).flatten()
-        p = np.array([[i for i in pnames] for _ in cnames]).flatten()
+        c = np.repeat(np.asarray(cnames), len(pnames))
+        p = np.tile(np.asarray(pnames), len(cnames))
 
         t = table.Table([c, p], names=('component', 'parameter'))
         h = fits.table_to_hdu(t)
@@ -233,118 +394,69 @@ class Cube:
             outimage = self.fitsfile.replace('.fits', suffix + '.fits')
 
         hdr = deepcopy(self.header_data)
-        try:
-            hdr['REDSHIFT'] = self.redshift
-        except KeyError:
-            hdr['REDSHIFT'] = (self.redshift, 'Redshift used in GMOSDC')
+        hdr['REDSHIFT'] = (self.redshift, 'Redshift used in GMOSDC')
 
-        # Creates MEF output.
-        h = fits.HDUList()
-        hdu = fits.PrimaryHDU(header=self.header)
-        hdu.name = 'PRIMARY'
-        h.append(hdu)
-
-        # Creates the fitted spectrum extension
-        hdr = fits.Header()
-        hdr['object'] = ('spectrum', 'Data in this extension')
-        hdr['CRPIX3'] = (1, 'Reference pixel for wavelength')
-        hdr['CRVAL3'] = (self.fit_wavelength[0], 'Reference value for wavelength')
-        hdr['CD3_3'] = (np.average(np.diff(self.fit_wavelength)), 'CD3_3')
-        hdu = fits.ImageHDU(data=self.fitspec, header=hdr)
-        hdu.name = 'FITSPEC'
-        h.append(hdu)
-
-        # Creates the fitted continuum extension.
-        hdr['object'] = 'continuum'
-        hdu = fits.ImageHDU(data=self.fitcont, header=hdr)
-        hdu.name = 'FITCONT'
-        h.append(hdu)
+        # Base header template shared by all image extensions. Each HDU
+        # gets its own copy with only the differing cards set, instead
+        # of repeatedly mutating a single header instance.
+        base = fits.Header()
+        base['CRPIX3'] = (1, 'Reference pixel for wavelength')
+        base['CRVAL3'] = (self.fit_wavelength[0], 'Reference value for wavelength')
+        base['CD3_3'] = (spectools.sampling_delta(self.fit_wavelength), 'CD3_3')
 
-        # Creates the stellar continuum extension.
-        hdr['object'] = 'stellar'
-        hdu = fits.ImageHDU(data=self.fitstellar, header=hdr)
-        hdu.name = 'STELLAR'
-        h.append(hdu)
-
-        # Creates the fitted function extension.
-        hdr['object'] = 'modeled_spec'
-        hdu = fits.ImageHDU(data=self.resultspec, header=hdr)
-        hdu.name = 'MODEL'
-        h.append(hdu)
-
-        # Creates the solution extension.
+        # Creates the solution header, with the fit description cards.
         function = args['function']
         total_pars = self.em_model.shape[0] - 1
 
-        hdr['object'] = 'parameters'
-        hdr['function'] = (function, 'Fitted function')
-        hdr['nfunc'] = (total_pars / self.npars, 'Number of functions')
-        hdr['fit_x0'] = self.fit_x0
-        hdr['fit_y0'] = self.fit_y0
-        hdu = fits.ImageHDU(data=self.em_model, header=hdr)
-        hdu.name = 'SOLUTION'
-        h.append(hdu)
-
-        # Creates the initial guess extension.
-        hdu = fits.ImageHDU(data=self.initial_guess, header=hdr)
-        hdu.name = 'INIGUESS'
-        h.append(hdu)
+        solution_hdr = base.copy()
+        solution_hdr['object'] = 'parameters'
+        solution_hdr['function'] = (function, 'Fitted function')
+        solution_hdr['nfunc'] = (total_pars / self.npars, 'Number of functions')
+        solution_hdr['fit_x0'] = self.fit_x0
+        solution_hdr['fit_y0'] = self.fit_y0
 
-        # Integrated flux extensions
-        hdr['object'] = 'flux_direct'
-        hdu = fits.ImageHDU(data=self.flux_direct, header=hdr)
-        hdu.name = 'FLUX_D'
-        h.append(hdu)
-
-        # Integrated flux extensions
-        hdr['object'] = 'flux_model'
-        hdu = fits.ImageHDU(data=self.flux_model, header=hdr)
-        hdu.name = 'FLUX_M'
-        h.append(hdu)
-
-        # Equivalent width extensions
-        hdr['object'] = 'eqw_model'
-        hdu = fits.ImageHDU(data=self.eqw_model, header=hdr)
-        hdu.name = 'EQW_M'
-        h.append(hdu)
-
-        hdr['object'] = 'eqw_direct'
-        hdu = fits.ImageHDU(data=self.eqw_direct, header=hdr)
-        hdu.name = 'EQW_D'
-        h.append(hdu)
-
-        # Creates the minimize's exit status extension
-        hdr['object'] = 'status'
-        hdu = fits.ImageHDU(data=self.fit_status, header=hdr)
-        hdu.name = 'STATUS'
-        h.append(hdu)
+        # Creates MEF output.
+        h = fits.HDUList([fits.PrimaryHDU(header=self.header)])
+        h[0].name = 'PRIMARY'
 
-        # Creates the spatial mask extension
-        hdr['object'] = 'spatial mask'
-        hdu = fits.ImageHDU(data=self.spatial_mask.astype(int), header=hdr)
-        hdu.name = 'MASK2D'
-        h.append(hdu)
+        image_extensions = [
+            ('FITSPEC', self.fitspec, ('spectrum', 'Data in this extension')),
+            ('FITCONT', self.fitcont, 'continuum'),
+            ('STELLAR', self.fitstellar, 'stellar'),
+            ('MODEL', self.resultspec, 'modeled_spec'),
+            ('SOLUTION', self.em_model, None),
+            ('INIGUESS', self.initial_guess, None),
+            ('FLUX_D', self.flux_direct, 'flux_direct'),
+            ('FLUX_M', self.flux_model, 'flux_model'),
+            ('EQW_M', self.eqw_model, 'eqw_model'),
+            ('EQW_D', self.eqw_direct, 'eqw_direct'),
+            ('STATUS', self.fit_status, 'status'),
+            ('MASK2D', self.spatial_mask.astype(int), 'spatial mask'),
+        ]
+
+        for name, data, obj in image_extensions:
+            if obj is None:
+                extension_hdr = solution_hdr
+            else:
+                extension_hdr = base.copy()
+                extension_hdr['object'] = obj
+            h.append(fits.ImageHDU(data=data, header=extension_hdr, name=name))
 
         # Creates the spaxel indices extension as fits.BinTableHDU.
-        hdr['object'] = 'spaxel_coords'
         t = table.Table(self.spec_indices, names=('row', 'column'))
         hdu = fits.table_to_hdu(t)
         hdu.name = 'SPECIDX'
         h.append(hdu)
 
         # Creates component and parameter names table.
-        hdr['object'] = 'parameter names'
         hdu = self._fit_table()
         hdu.name = 'PARNAMES'
         h.append(hdu)
 
-        original_cube = fits.open(self.fitsfile)
-        for ext_name in ['vor', 'vorplus']:
-            if ext_name in original_cube:
-                h.append(original_cube[ext_name])
+        for hdu in self._vor_hdus or []:
+            h.append(hdu)
 
-        h.writeto(outimage, overwrite=args['overwrite'])
-        original_cube.close()
+        h.writeto(outimage, overwrite=args['overwrite'], output_verify='ignore')
 
     def _write_eqw(self, eqw, args):
 
@@ -406,9 +518,11 @@ class Cube:
         t = np.arctan2(y - spiral_center[1], x - spiral_center[0])
         t[t < 0] += 2 * np.pi
 
-        b = np.array([
-            (np.ravel(r)[i], np.ravel(t)[i]) for i in range(len(np.ravel(r)))],
-            dtype=[('radius', 'f8'), ('angle', 'f8')])
+        rr = np.ravel(r)
+        tt = np.ravel(t)
+        b = np.empty(rr.size, dtype=[('radius', 'f8'), ('angle', 'f8')])
+        b['radius'] = rr
+        b['angle'] = tt
 
         s = np.argsort(b, axis=0, order=['radius', 'angle'])
         xy = np.column_stack([np.ravel(y)[s], np.ravel(x)[s]])
@@ -430,35 +544,35 @@ class Cube:
         hdr = fits.Header()
         hdr['CRPIX3'] = (1, 'Reference pixel for wavelength')
         hdr['CRVAL3'] = (self.rest_wavelength[0], 'Reference value for wavelength')
-        hdr['CD3_3'] = (np.average(np.diff(self.rest_wavelength)), 'CD3_3')
-        hdu = fits.ImageHDU(data=self.data, header=hdr)
-        hdu.name = 'SCI'
-        h.append(hdu)
+        hdr['CD3_3'] = (spectools.sampling_delta(self.rest_wavelength), 'CD3_3')
 
-        hdu = fits.ImageHDU(data=self.variance, header=hdr)
-        hdu.name = 'VAR'
-        h.append(hdu)
+        # Tile-compressed extensions for the full-size cubes, which
+        # dominate both the write time and the size of the output
+        # file. A quantization level of zero selects lossless
+        # compression for the floating point data.
+        comp_opts = dict(compression_type='GZIP_2', quantize_level=0.0)
+        h.append(fits.CompImageHDU(data=self.data, header=hdr, name='SCI', **comp_opts))
+
+        h.append(fits.CompImageHDU(data=self.variance, header=hdr, name='VAR', **comp_opts))
 
         hdu = fits.ImageHDU(data=self.spatial_mask.astype(int), header=hdr)
         hdu.name = 'MASK2D'
         h.append(hdu)
 
         if hasattr(self, 'flags'):
-            hdu = fits.ImageHDU(data=self.flags.astype(int), header=hdr)
-            hdu.name = 'FLAGS'
-            h.append(hdu)
+            h.append(fits.CompImageHDU(data=self.flags.astype(np.int32), header=hdr, name='FLAGS',
+                                       compression_type='RICE_1'))
 
         if hasattr(self, 'stellar'):
             # noinspection PyTypeChecker
-            hdu = fits.ImageHDU(data=self.stellar, header=hdr)
-            hdu.name = 'STELLAR'
-            h.append(hdu)
+            h.append(fits.CompImageHDU(data=self.stellar, header=hdr, name='STELLAR', **comp_opts))
 
         if self.ppxf_sol is not None:
+            # The fit parameters do not carry more than single
+            # precision worth of significant digits.
             # noinspection PyTypeChecker
-            hdu = fits.ImageHDU(data=self.ppxf_sol, header=hdr)
-            hdu.name = 'PPXFSOL'
-            h.append(hdu)
+            h.append(fits.CompImageHDU(data=self.ppxf_sol.astype(np.float32), header=hdr, name='PPXFSOL',
+                                       **comp_opts))
 
         with fits.open(self.fitsfile) as original_cube:
             for ext_name in ['vor', 'vorplus']:
@@ -486,17 +600,35 @@ class Cube:
 
         if self.binned:
             v = self.voronoi_tab
-            xy = np.column_stack(
-                [v[np.unique(v['binNum'], return_index=True)[1]][coords] for coords in ['xcoords', 'ycoords']])
+            # Plain integer ndarray copies of the table columns, read
+            # once, so everything below runs on raw NumPy instead of
+            # astropy Column wrappers.
+            vor_y = np.asarray(v['ycoords'], dtype=np.int32)
+            vor_x = np.asarray(v['xcoords'], dtype=np.int32)
+            vor_bn = np.asarray(v['binNum'], dtype=np.int32)
+            first_bin_index = np.unique(vor_bn, return_index=True)[1]
+            # Filling a preallocated two-column array writes each
+            # coordinate slice straight into place, instead of the
+            # temporaries plus stacking copy of np.column_stack.
+            xy = np.empty((first_bin_index.size, 2), dtype=np.int32)
+            xy[:, 0] = vor_y[first_bin_index]
+            xy[:, 1] = vor_x[first_bin_index]
+            vor = np.column_stack((vor_y, vor_x, vor_bn))
         else:
-            v = None
+            vor = None
             xy = self.spec_indices
 
         fw = fitting_window
-        fwidx = (self.rest_wavelength > fw[0]) & (self.rest_wavelength < fw[1])
+        fwidx = self._window_slice(fw)
 
-        wl = deepcopy(self.rest_wavelength[fwidx])
-        data = deepcopy(self.data[fwidx])
+        # Slicing with the window returns views of the wavelength
+        # vector and the data cube, so no copies are made here.
+        wl = self.rest_wavelength[fwidx]
+        data = self.data[fwidx]
+        # Spaxel-major copy of the working slab, so that each spectrum read
+        # inside the loop below is a contiguous view instead of a strided
+        # walk through the wavelength axis of the cube.
+        data_soa = np.ascontiguousarray(np.moveaxis(data, 0, -1))
 
         c = np.zeros_like(data)
 
@@ -510,12 +642,12 @@ class Cube:
 
         for k, h in enumerate(xy):
             i, j = h
-            s = deepcopy(data[:, i, j])
+            s = data_soa[i, j]
             if (any(s[:20]) and any(s[-20:])) or (any(np.isnan(s[:20])) and any(np.isnan(s[-20:]))):
                 try:
                     cont = spectools.continuum(wl, s, **continuum_options)
-                    if v is not None:
-                        for l, m in v[v[:, 2] == k, :2]:
+                    if vor is not None:
+                        for l, m in vor[vor[:, 2] == k, :2]:
                             c[:, l, m] = cont[1]
                     else:
                         c[:, i, j] = cont[1]
@@ -535,10 +667,7 @@ class Cube:
 
             hdr = deepcopy(self.header_data)
 
-            try:
-                hdr['REDSHIFT'] = self.redshift
-            except KeyError:
-                hdr['REDSHIFT'] = (self.redshift, 'Redshift used in GMOSDC')
+            hdr['REDSHIFT'] = (self.redshift, 'Redshift used in GMOSDC')
 
             hdr['CRVAL3'] = wl[0]
             hdr['CONTDEGR'] = (continuum_options['degree'], 'Degree of continuum polynomial')
@@ -571,20 +700,22 @@ class Cube:
             Image of the SNR for each spectrum.
         """
 
-        snr_window = (self.rest_wavelength >= wl_range[0]) & (self.rest_wavelength <= wl_range[1])
+        snr_window = self._window_slice(wl_range, inclusive=True)
 
-        # FIXME: This is only here because I am always setting
-        # a variance attribute, when it really shouldn't be.
-        # The correct behaviour should be to check if variance is set.
-        # if hasattr(self, 'variance'):
-        if not np.all(self.variance == 1.):
-            noise = np.nanmean(np.sqrt(self.variance[snr_window, :, :]), axis=0)
-            signal = np.nanmean(self.data[snr_window, :, :], axis=0)
+        if self._has_variance:
+            # Spaxel-major copies of the window slabs, so that the
+            # reductions below run along the contiguous axis.
+            v_win = np.ascontiguousarray(np.moveaxis(self.variance[snr_window], 0, -1))
+            d_win = np.ascontiguousarray(np.moveaxis(self.data[snr_window], 0, -1))
+            noise = np.nanmean(np.sqrt(v_win), axis=-1)
+            signal = np.nanmean(d_win, axis=-1)
 
         else:
             noise = np.zeros(np.shape(self.data)[1:])
             signal = np.zeros(np.shape(self.data)[1:])
-            data = deepcopy(self.data)
+            # Spaxel-major copy of the window slab, so that each
+            # spectrum read below is contiguous.
+            data = np.ascontiguousarray(np.moveaxis(self.data[snr_window], 0, -1))
 
             wl = self.rest_wavelength[snr_window]
 
@@ -594,15 +725,22 @@ class Cube:
             else:
                 continuum_options['output'] = 'function'
 
-            for i, j in self.spec_indices:
-                if any(data[snr_window, i, j]) and all(~np.isnan(data[snr_window, i, j])):
-                    s = data[snr_window, i, j]
+            def spaxel_snr(h):
+                i, j = h
+                s = data[i, j]
+                if any(s) and all(~np.isnan(s)):
                     cont = spectools.continuum(wl, s, **continuum_options)[1]
                     noise[i, j] = np.nanstd(s - cont)
                     signal[i, j] = np.nanmean(cont)
                 else:
                     noise[i, j], signal[i, j] = np.nan, np.nan
 
+            # The per-spaxel fits are independent, and each one writes
+            # to a different pixel of the output images, so they can be
+            # dispatched to a thread pool.
+            with ThreadPoolExecutor() as executor:
+                list(executor.map(spaxel_snr, self.spec_indices))
+
         signal[signal == 0.0] = np.nan
         noise[(noise == 0.0) | (noise == 1.0)] = np.nan
 
@@ -646,10 +784,7 @@ class Cube:
 
             hdr = deepcopy(self.header)
 
-            try:
-                hdr['REDSHIFT'] = self.redshift
-            except KeyError:
-                hdr['REDSHIFT'] = (self.redshift, 'Redshift used in GMOSDC')
+            hdr['REDSHIFT'] = (self.redshift, 'Redshift used in GMOSDC')
 
             hdr['WLPROJ'] = (True, 'Processed by WLPROJECTION?')
             hdr['WLPRTYPE'] = (filtertype,
@@ -687,15 +822,20 @@ class Cube:
         if y0 is None:
             y0 = int(self.spec_indices[:, 0].mean())
 
-        sci, npix_sci = cubetools.aperture_spectrum(
-            self.data, x0=x0, y0=y0, radius=radius, combine='sum')
-        var, npix_var = cubetools.aperture_spectrum(
-            self.variance, x0=x0, y0=y0, radius=radius, combine='sum')
-        if np.all(self.variance == 1.0):
+        # The aperture membership mask is the same for all four cubes,
+        # so it is evaluated only once, and the aperture pixels are
+        # gathered into contiguous slabs that each reduction reuses.
+        y, x = self._index_grids()
+        r2 = (x - x0) ** 2 + (y - y0) ** 2
+        aperture = r2 <= radius ** 2
+
+        sci = ma.masked_invalid(self.data[:, aperture]).sum(axis=1)
+        if self._has_variance:
+            var = ma.masked_invalid(self.variance[:, aperture]).sum(axis=1)
+        else:
             var = self.variance[:, 0, 0]
-        ste, npix_ste = cubetools.aperture_spectrum(self.stellar, x0=x0, y0=y0, radius=radius, combine='sum')
-        fla, npix_fla = cubetools.aperture_spectrum(
-            (self.flags.astype('bool')).astype('float64'), x0=x0, y0=y0, radius=radius, combine='mean')
+        ste = ma.masked_invalid(self.stellar[:, aperture]).sum(axis=1)
+        fla = ma.masked_invalid(self.flags[:, aperture].astype('float64')).mean(axis=1)
 
         # NOTE: This only makes sense when the flags are only ones
         # and zeros, that is why the flag combination has to ensure
@@ -744,20 +884,20 @@ class Cube:
             ax = fig.add_subplot(111)
 
         if hasattr(x, '__iter__') and hasattr(y, '__iter__'):
-            s = np.average(np.average(self.data[:, y[0]:y[1], x[0]:x[1]], 1), 1)
+            s = self.data[:, y[0]:y[1], x[0]:x[1]].mean(axis=(1, 2))
         elif hasattr(x, '__iter__') and not hasattr(y, '__iter__'):
-            s = np.average(self.data[:, y, x[0]:x[1]], 1)
+            s = self.data[:, y, x[0]:x[1]].mean(axis=1)
         elif not hasattr(x, '__iter__') and hasattr(y, '__iter__'):
-            s = np.average(self.data[:, y[0]:y[1], x], 1)
+            s = self.data[:, y[0]:y[1], x].mean(axis=1)
         else:
             s = self.data[:, y, x]
 
         if hasattr(x, '__iter__') and hasattr(y, '__iter__'):
-            syn = np.average(np.average(self.stellar[:, y[0]:y[1], x[0]:x[1]], 1), 1)
+            syn = self.stellar[:, y[0]:y[1], x[0]:x[1]].mean(axis=(1, 2))
         elif hasattr(x, '__iter__') and not hasattr(y, '__iter__'):
-            syn = np.average(self.stellar[:, y, x[0]:x[1]], 1)
+            syn = self.stellar[:, y, x[0]:x[1]].mean(axis=1)
         elif not hasattr(x, '__iter__') and hasattr(y, '__iter__'):
-            syn = np.average(self.stellar[:, y[0]:y[1], x], 1)
+            syn = self.stellar[:, y[0]:y[1], x].mean(axis=1)
         else:
             syn = self.stellar[:, y, x]
 
@@ -767,11 +907,11 @@ class Cube:
         if show_noise and (self.noise_cube is not None):
 
             if hasattr(x, '__iter__') and hasattr(y, '__iter__'):
-                n = np.average(np.average(self.noise_cube[:, y[0]:y[1], x[0]:x[1]], 1), 1)
+                n = self.noise_cube[:, y[0]:y[1], x[0]:x[1]].mean(axis=(1, 2))
             elif hasattr(x, '__iter__') and not hasattr(y, '__iter__'):
-                n = np.average(self.noise_cube[:, y, x[0]:x[1]], 1)
+                n = self.noise_cube[:, y, x[0]:x[1]].mean(axis=1)
             elif not hasattr(x, '__iter__') and hasattr(y, '__iter__'):
-                n = np.average(self.noise_cube[:, y[0]:y[1], x], 1)
+                n = self.noise_cube[:, y[0]:y[1], x].mean(axis=1)
             else:
                 n = self.noise_cube[:, y, x]
 
@@ -867,14 +1007,19 @@ class Cube:
 
         fitting_window = kwargs.get('fitting_window', None)
         if fitting_window is not None:
-            fw_mask = ((self.rest_wavelength > fitting_window[0]) & (self.rest_wavelength < fitting_window[1]))
+            fw_mask = self._window_mask(fitting_window)
             fit_npixels = np.sum(fw_mask)
         else:
-            fw_mask = np.ones_like(self.rest_wavelength).astype('bool')
+            fw_mask = np.ones(self.rest_wavelength.shape, dtype=bool)
             fit_npixels = self.rest_wavelength.size
 
+        # The boolean indexing above copies the windowed data, so the
+        # slab is extracted once here and shared by the assertion, the
+        # peak and center of mass searches, and the dead spaxel screen.
+        window_data = self.data[fw_mask]
+
         # A few assertions
-        assert np.any(self.data[fw_mask]), 'No valid data within the fitting window.'
+        assert np.any(window_data), 'No valid data within the fitting window.'
 
         fit_shape = (fit_npixels,) + self.data.shape[1:]
 
@@ -886,7 +1031,11 @@ class Cube:
         vcube = self.variance
         variance = kwargs.get('variance', None)
         if variance is not None:
-            vcube = self._arg2cube(variance, vcube)
+            if self._has_variance:
+                vcube = self._arg2cube(variance, np.array(self.variance))
+            else:
+                vcube = self._broadcast_arg(variance)
+            self.variance = vcube
 
         #
         # Set the weight cube.
@@ -894,7 +1043,11 @@ class Cube:
         wcube = self.weights
         weights = kwargs.get('weights', None)
         if weights is not None:
-            wcube = self._arg2cube(weights, wcube)
+            if self._has_weights:
+                wcube = self._arg2cube(weights, np.array(self.weights))
+            else:
+                wcube = self._broadcast_arg(weights)
+            self.weights = wcube
 
         #
         # Set the flags cube.
@@ -902,7 +1055,11 @@ class Cube:
         flag_cube = self.flags
         flags = kwargs.get('flags', None)
         if flags is not None:
-            flag_cube = self._arg2cube(flags, flag_cube)
+            if self._has_flags:
+                flag_cube = self._arg2cube(flags, np.array(self.flags))
+            else:
+                flag_cube = self._broadcast_arg(flags)
+            self.flags = flag_cube
 
         npars = len(p0)
         sol = np.zeros((npars + 1,) + self.data.shape[1:])
@@ -915,24 +1072,44 @@ class Cube:
         self.fitbounds = np.zeros((npars * 2,) + self.data.shape[1:])
 
         v = None
-        vor = None
+        spaxel_bin = None
+        bin_members = None
         if self.binned:
             v = self.voronoi_tab
-            xy = np.column_stack([
-                v[np.unique(v['binNum'], return_index=True)[1]][coords] for coords in ['ycoords', 'xcoords']])
-            vor = np.column_stack([v[coords] for coords in ['ycoords', 'xcoords', 'binNum']])
+            # Plain integer ndarray copies of the table columns, read
+            # once, so everything below runs on raw NumPy instead of
+            # astropy Column wrappers.
+            vor_y = np.asarray(v['ycoords'], dtype=np.int32)
+            vor_x = np.asarray(v['xcoords'], dtype=np.int32)
+            vor_bn = np.asarray(v['binNum'], dtype=np.int32)
+            first_bin_index = np.unique(vor_bn, return_index=True)[1]
+            # Filling a preallocated two-column array writes each
+            # coordinate slice straight into place, instead of the
+            # temporaries plus stacking copy of np.column_stack.
+            xy = np.empty((first_bin_index.size, 2), dtype=np.int32)
+            xy[:, 0] = vor_y[first_bin_index]
+            xy[:, 1] = vor_x[first_bin_index]
+            vor = np.column_stack((vor_y, vor_x, vor_bn))
+            # Maps each spaxel to its bin and each bin to the
+            # coordinates of all its members, replacing the per-spaxel
+            # scans of the full Voronoi table inside the fit loop.
+            spaxel_bin = {}
+            bin_members = {}
+            for y_bin, x_bin, num in vor:
+                spaxel_bin[(y_bin, x_bin)] = num
+                bin_members.setdefault(num, []).append((y_bin, x_bin))
         else:
             xy = self.spec_indices
 
         # Saves the original bounds in case the bound updater is used.
         original_bounds = deepcopy(kwargs.get('bounds', None))
 
-        yy, xx = np.indices(fit_shape[1:])
+        yy, xx = self._index_grids()
         if individual_spec is not None:
             if individual_spec == 'peak':
-                xy = [cubetools.peak_spaxel(self.data[fw_mask])[::-1]]
+                xy = [cubetools.peak_spaxel(window_data)[::-1]]
             elif individual_spec == 'cofm':
-                xy = [[int(np.round(i, 0)) for i in center_of_mass(self.data[fw_mask].sum(axis=0))]]
+                xy = [[int(np.round(i, 0)) for i in center_of_mass(window_data.sum(axis=0))]]
             else:
                 xy = [individual_spec[::-1]]
             if verbose:
@@ -941,13 +1118,29 @@ class Cube:
                 'Requested spaxel is either masked or outside the data cube.'
         elif spiral_loop:
             if spiral_center == 'peak':
-                spiral_center = cubetools.peak_spaxel(self.data[fw_mask])
+                spiral_center = cubetools.peak_spaxel(window_data)
             elif spiral_center == 'cofm':
-                spiral_center = [int(np.round(i, 0)) for i in center_of_mass(self.data[fw_mask].sum(axis=0))]
+                spiral_center = [int(np.round(i, 0)) for i in center_of_mass(window_data.sum(axis=0))]
             if verbose:
                 print(spiral_center)
             xy = self._spiral(xy, spiral_center=spiral_center)
 
+        if individual_spec is None:
+            # Spaxels with no valid data inside the fitting window
+            # would pay the full Spectrum construction and fit cost
+            # only to fail, so they are flagged here and dropped from
+            # the iteration instead.
+            dead = ~np.any(np.isfinite(window_data) & (window_data != 0), axis=0)
+            if np.any(dead):
+                alive_xy = [(i, j) for i, j in xy if not dead[i, j]]
+                for i, j in xy:
+                    if dead[i, j]:
+                        self.fit_status[i, j] = -2
+                        sol[:, i, j] = np.nan
+                xy = np.asarray(alive_xy, dtype=np.int32).reshape(-1, 2)
+                if len(xy) == 0:
+                    raise RuntimeError('No spectra to fit.')
+
         self.fit_y0, self.fit_x0 = xy[0]
 
         if verbose == 1:
@@ -955,46 +1148,21 @@ class Cube:
         else:
             iterator = xy
 
-        is_first_spec = True
-
         if len(iterator) == 0:
             raise RuntimeError('No spectra to fit.')
 
-        spec = None
-        for h in iterator:
-
+        def fit_spaxel(h, spec=None):
             i, j = h
-            bin_num = None
-            if v is not None:
-                bin_num = vor[(vor[:, 0] == i) & (vor[:, 1] == j), 2]
-
             cube_slice = (Ellipsis, i, j)
 
-            spec = onedspec.Spectrum()
-            spec.rest_wavelength = self.rest_wavelength
+            if spec is None:
+                spec = onedspec.Spectrum()
+                spec.rest_wavelength = self.rest_wavelength
             spec.data = self.data[cube_slice]
             spec.variance = self.variance[cube_slice]
             spec.flags = self.flags[cube_slice]
             spec.stellar = self.stellar[cube_slice]
 
-            if refit and not is_first_spec:
-
-                radsol = np.sqrt((yy - i) ** 2 + (xx - j) ** 2)
-                nearsol = sol[:-1, (radsol < refit_radius) & (self.fit_status == 0)]
-
-                old_p0 = deepcopy(p0)
-                p0 = np.average(nearsol.transpose(), 0)
-                if np.isnan(p0).any():
-                    if debug:
-                        print('Skipped refit on spaxel {:d}, {:d}.'.format(i, j))
-                        print('old' + str(old_p0))
-                        print('new' + str(p0))
-                        print('Reverting to old p0.')
-                    p0 = old_p0
-
-                if update_bounds:
-                    kwargs['bounds'] = cubetools.bound_updater(p0, bound_range, bounds=original_bounds)
-
             if debug:
                 try:
                     spec.linefit(p0, **kwargs)
@@ -1004,16 +1172,9 @@ class Cube:
             else:
                 spec.linefit(p0, **kwargs)
 
-            # TODO: This fit_status should not be exclusive to refit.
-            if refit and np.isnan(spec.em_model).any():
-                spec.fit_status = 400
-
-            self.feature_wl = kwargs['feature_wl']
-
-            # If successful, sets is_first_spec to False.
-            if is_first_spec and (spec.fit_status == 0):
-                is_first_spec = False
+            return spec
 
+        def store_result(i, j, spec):
             if self.eqw_model is None:
                 self.eqw_model = np.zeros((len(spec.component_names),) + self.fit_status.shape)
                 self.eqw_direct = np.zeros_like(self.eqw_model)
@@ -1023,33 +1184,142 @@ class Cube:
                 self.flux_direct = np.zeros_like(self.eqw_model)
 
             if self.binned:
-                for l, m in vor[vor[:, 2] == bin_num, :2]:
-                    sol[:, l, m] = spec.em_model
-                    self.fitcont[:, l, m] = spec.fitcont
-                    self.fitspec[:, l, m] = spec.fitspec
-                    self.resultspec[:, l, m] = spec.resultspec
-                    self.fitstellar[:, l, m] = spec.fitstellar
-                    self.fit_status[l, m] = spec.fit_status
-                    self.eqw_model[:, l, m] = spec.eqw_model
-                    self.eqw_direct[:, l, m] = spec.eqw_direct
-                    self.flux_model[:, l, m] = spec.flux_model
-                    self.flux_direct[:, l, m] = spec.flux_direct
-                    self.initial_guess[:, l, m] = spec.initial_guess
-                    self.fitbounds[:, l, m] = [
-                        k if k is not None else np.nan for k in np.array(spec.fitbounds).flatten()]
+                targets = bin_members[spaxel_bin[(i, j)]]
             else:
-                sol[:, i, j] = spec.em_model
-                self.fitcont[:, i, j] = spec.fitcont
-                self.fitspec[:, i, j] = spec.fitspec
-                self.fitstellar[:, i, j] = spec.fitstellar
-                self.resultspec[:, i, j] = spec.resultspec
-                self.fit_status[i, j] = spec.fit_status
-                self.eqw_model[:, i, j] = spec.eqw_model
-                self.eqw_direct[:, i, j] = spec.eqw_direct
-                self.flux_model[:, i, j] = spec.flux_model
-                self.flux_direct[:, i, j] = spec.flux_direct
-                self.initial_guess[:, i, j] = spec.initial_guess
-                self.fitbounds[:, i, j] = [k if k is not None else np.nan for k in np.array(spec.fitbounds).flatten()]
+                targets = [(i, j)]
+
+            for l, m in targets:
+                sol[:, l, m] = spec.em_model
+                self.fitcont[:, l, m] = spec.fitcont
+                self.fitspec[:, l, m] = spec.fitspec
+                self.resultspec[:, l, m] = spec.resultspec
+                self.fitstellar[:, l, m] = spec.fitstellar
+                self.fit_status[l, m] = spec.fit_status
+                self.eqw_model[:, l, m] = spec.eqw_model
+                self.eqw_direct[:, l, m] = spec.eqw_direct
+                self.flux_model[:, l, m] = spec.flux_model
+                self.flux_direct[:, l, m] = spec.flux_direct
+                self.initial_guess[:, l, m] = spec.initial_guess
+                self.fitbounds[:, l, m] = spec.fitbounds
+
+        self.feature_wl = kwargs['feature_wl']
+
+        spec = None
+        if refit:
+            # The refit path seeds each spaxel with the solutions of
+            # its already fitted neighbours, so the spectra have to be
+            # fitted in iteration order. A single Spectrum instance is
+            # reused for every spaxel, since each fit fully overwrites
+            # the previous state.
+            is_first_spec = True
+            bounds_buffer = None
+            spec = onedspec.Spectrum()
+            spec.rest_wavelength = self.rest_wavelength
+            for h in iterator:
+
+                i, j = h
+
+                if not is_first_spec:
+
+                    # Compares squared distances, which is equivalent
+                    # to the radius comparison and skips a full-grid
+                    # square root on every spaxel.
+                    radsol_squared = (yy - i) ** 2 + (xx - j) ** 2
+                    nearsol = sol[:-1, (radsol_squared < refit_radius ** 2) & (self.fit_status == 0)]
+
+                    old_p0 = np.array(p0)
+                    p0 = np.average(nearsol.transpose(), 0)
+                    if np.isnan(p0).any():
+                        if debug:
+                            print('Skipped refit on spaxel {:d}, {:d}.'.format(i, j))
+                            print('old' + str(old_p0))
+                            print('new' + str(p0))
+                            print('Reverting to old p0.')
+                        p0 = old_p0
+
+                    if update_bounds:
+                        # The same buffer is updated in place on every
+                        # spaxel; Spectrum.linefit copies what it needs.
+                        bounds_buffer = cubetools.bound_updater(p0, bound_range, bounds=original_bounds,
+                                                                out=bounds_buffer)
+                        kwargs['bounds'] = bounds_buffer
+
+                fit_spaxel(h, spec)
+
+                # TODO: This fit_status should not be exclusive to refit.
+                if np.isnan(spec.em_model).any():
+                    spec.fit_status = 400
+
+                # If successful, sets is_first_spec to False.
+                if is_first_spec and (spec.fit_status == 0):
+                    is_first_spec = False
+
+                store_result(i, j, spec)
+        else:
+            # Without refit the spaxels are independent, so the fits
+            # can be dispatched to a thread pool. Results are gathered
+            # into contiguous per-spaxel buffers during the loop, and
+            # scattered into the output cubes with one vectorized
+            # assignment per array at the end, instead of ten strided
+            # writes per spaxel.
+            n_spec = len(xy)
+            buffers = None
+            with ThreadPoolExecutor() as executor:
+                for k, (h, spec) in enumerate(zip(iterator, executor.map(fit_spaxel, xy))):
+                    if buffers is None:
+                        n_components = len(spec.component_names)
+                        buffers = {
+                            'em_model': np.empty((n_spec, npars + 1)),
+                            'fitcont': np.empty((n_spec, fit_npixels)),
+                            'fitspec': np.empty((n_spec, fit_npixels)),
+                            'fitstellar': np.empty((n_spec, fit_npixels)),
+                            'resultspec': np.empty((n_spec, fit_npixels)),
+                            'fit_status': np.empty(n_spec, dtype=int),
+                            'eqw_model': np.empty((n_spec, n_components)),
+                            'eqw_direct': np.empty((n_spec, n_components)),
+                            'flux_model': np.empty((n_spec, n_components)),
+                            'flux_direct': np.empty((n_spec, n_components)),
+                            'initial_guess': np.empty((n_spec, npars)),
+                            'fitbounds': np.empty((n_spec, npars * 2)),
+                        }
+                    for name in buffers:
+                        buffers[name][k] = getattr(spec, name)
+
+            if self.eqw_model is None:
+                self.eqw_model = np.zeros((n_components,) + self.fit_status.shape)
+                self.eqw_direct = np.zeros_like(self.eqw_model)
+
+            if self.flux_model is None:
+                self.flux_model = np.zeros((n_components,) + self.fit_status.shape)
+                self.flux_direct = np.zeros_like(self.eqw_model)
+
+            # Expands the fitted spaxels to all members of their
+            # Voronoi bins before the final scatter.
+            coords = np.asarray(xy, dtype=int)
+            if self.binned:
+                source, rows, columns = [], [], []
+                for k, (i, j) in enumerate(coords):
+                    for l, m in bin_members[spaxel_bin[(i, j)]]:
+                        source.append(k)
+                        rows.append(l)
+                        columns.append(m)
+                source, rows, columns = [np.asarray(index, dtype=int) for index in (source, rows, columns)]
+            else:
+                source = np.arange(n_spec)
+                rows, columns = coords[:, 0], coords[:, 1]
+
+            sol[:, rows, columns] = buffers['em_model'].T[:, source]
+            self.fitcont[:, rows, columns] = buffers['fitcont'].T[:, source]
+            self.fitspec[:, rows, columns] = buffers['fitspec'].T[:, source]
+            self.fitstellar[:, rows, columns] = buffers['fitstellar'].T[:, source]
+            self.resultspec[:, rows, columns] = buffers['resultspec'].T[:, source]
+            self.fit_status[rows, columns] = buffers['fit_status'][source]
+            self.eqw_model[:, rows, columns] = buffers['eqw_model'].T[:, source]
+            self.eqw_direct[:, rows, columns] = buffers['eqw_direct'].T[:, source]
+            self.flux_model[:, rows, columns] = buffers['flux_model'].T[:, source]
+            self.flux_direct[:, rows, columns] = buffers['flux_direct'].T[:, source]
+            self.initial_guess[:, rows, columns] = buffers['initial_guess'].T[:, source]
+            self.fitbounds[:, rows, columns] = buffers['fitbounds'].T[:, source]
 
         self.fit_wavelength = spec.fitwl
         self.fit_func = spec.fit_func
@@ -1088,7 +1358,9 @@ class Cube:
         Nothing.
         """
 
-        fit_file = fits.open(fname)
+        if self._fit_file is not None:
+            self._fit_file.close()
+        fit_file = fits.open(fname, memmap=True, lazy_load_hdus=True)
         if not hasattr(self, 'header'):
             self.header = fit_file[0].header
 
@@ -1171,7 +1443,10 @@ class Cube:
 
         self.fit_info = fit_info
 
-        fit_file.close()
+        # The file handle is kept open so that the arrays above remain
+        # memory-mapped views; extension data is only read from disk
+        # when it is actually accessed.
+        self._fit_file = fit_file
 
     def w80(self, component: int, sigma_factor: float = 5.0, individual_spec: Union[bool, tuple] = False,
             verbose: bool = False, smooth: float = None, remove_components: Union[None, Iterable, str] = None) -> \
@@ -1242,38 +1517,55 @@ class Cube:
         if center_index > self.em_model.shape[0]:
             raise RuntimeError('Specified component number is higher than the total number of components.')
 
+        light_speed = 2.99792e+5  # km/s
+        # Wavelength vector of the line fit
+        fwl = self.fit_wavelength
+        # Just a short alias for the sigma_factor parameter
+        sf = sigma_factor
+
+        # Center wavelength and sigma of the fit in wavelength units,
+        # along with the validity flags, evaluated for every spaxel in
+        # a single vectorized pass instead of once per loop iteration.
+        cwl = (self.em_model[center_index] / light_speed + 1.0) * self.feature_wl[component]
+        sig = (self.em_model[sigma_index] / light_speed) * self.feature_wl[component]
+        invalid = np.isnan(self.em_model[par_indexes]).any(axis=0) | (cwl == 0)
+
+        # Spaxel-major float32 copies of the fit products. Each read
+        # in the loop below becomes a contiguous slab at half the
+        # memory traffic, and the continuum subtraction is fused into
+        # one vectorized pass over the cube. The profile functions
+        # work on 32-bit floats anyway.
+        em_soa = np.ascontiguousarray(np.moveaxis(self.em_model, 0, -1), dtype=np.float32)
+        residual_soa = np.ascontiguousarray(
+            np.moveaxis(self.fitspec - self.fitcont - self.fitstellar, 0, -1), dtype=np.float32)
+
+        if remove_components == 'all':
+            remove_components = [k for k in range(len(self.feature_wl)) if k != component]
+
         for i, j in xy:
 
             if verbose:
                 print(i, j)
 
-            light_speed = 2.99792e+5  # km/s
-            # Wavelength vector of the line fit
-            fwl = self.fit_wavelength
-            # Center wavelength coordinate of the fit
-            cwl = (self.em_model[center_index, i, j] / light_speed + 1.0) * self.feature_wl[component]
-            # Sigma of the fit
-            sig = (self.em_model[sigma_index, i, j] / light_speed) * self.feature_wl[component]
-            # Just a short alias for the sigma_factor parameter
-            sf = sigma_factor
-
-            nandata_flag = np.any(np.isnan(self.em_model[par_indexes, i, j]))
-            nullcwl_flag = cwl == 0
-
-            if nandata_flag or nullcwl_flag:
+            if invalid[i, j]:
 
                 w80_model[i, j] = np.nan
                 w80_direct[i, j] = np.nan
 
             else:
 
-                cond = (fwl > (cwl - (sf * sig))) & (fwl < (cwl + (sf * sig)))
-                fit = self.fit_func(fwl[cond], self.feature_wl[component], self.em_model[par_indexes, i, j])
-                obs_spec = self.fitspec[cond, i, j] - self.fitcont[cond, i, j] - self.fitstellar[cond, i, j]
+                # The integration window is a contiguous run of the
+                # monotonic fit wavelength vector, so a slice view
+                # replaces the boolean mask here.
+                half_width = sf * sig[i, j]
+                cond = slice(np.searchsorted(fwl, cwl[i, j] - half_width, side='right'),
+                             np.searchsorted(fwl, cwl[i, j] + half_width, side='left'))
+                fit = self.fit_func(fwl[cond], self.feature_wl[component], em_soa[i, j, par_indexes])
+                obs_spec = residual_soa[i, j, cond]
 
                 # Evaluates the W80 over the modeled emission line.
                 # noinspection PyTupleAssignmentBalance
-                w80_model[i, j], m0, m1, mv, ms = spectools.w80eval(fwl[cond], fit, cwl)
+                w80_model[i, j], m0, m1, mv, ms = spectools.w80eval(fwl[cond], fit, cwl[i, j])
 
                 # Evaluating the W80 over the observed spectrum
                 # directly is a bit more complicated due to the overlap
@@ -1281,15 +1573,13 @@ class Cube:
                 # here is to remove the undesired components from the
                 # observed spectrum.
                 if remove_components is not None:
-                    if remove_components == 'all':
-                        remove_components = [i for i in range(len(self.feature_wl)) if i != component]
                     for k in remove_components:
                         ci = k * npars
                         obs_spec -= self.fit_func(
-                            fwl[cond], self.feature_wl[k], self.em_model[ci:ci + npars, i, j])
+                            fwl[cond], self.feature_wl[k], em_soa[i, j, ci:ci + npars])
                 # And now for the actual W80 evaluation.
                 # noinspection PyTupleAssignmentBalance
-                w80_direct[i, j], d0, d1, dv, ds = spectools.w80eval(fwl[cond], obs_spec, cwl, smooth=smooth)
+                w80_direct[i, j], d0, d1, dv, ds = spectools.w80eval(fwl[cond], obs_spec, cwl[i, j], smooth=smooth)
 
                 # Plots the fit when evaluating only one spectrum.
                 if len(xy) == 1:
@@ -1357,7 +1647,7 @@ class Cube:
         median_spec = np.median(s)
 
         if median_spec > 0:
-            norm_factor_d = np.int(np.log10(median_spec))
+            norm_factor_d = int(np.log10(median_spec))
             norm_factor = 10.0 ** norm_factor_d
         else:
             return ax
@@ -1366,10 +1656,18 @@ class Cube:
         for i in mask:
             ax.axvspan(i[0], i[1], color='grey', alpha=0.1)
 
-        ax.plot(wl, s / norm_factor)
-        ax.plot(wl, star / norm_factor)
-        ax.plot(wl, (star + c) / norm_factor)
-        ax.plot(wl, (c + star + f(wl, rest_wl, pp)) / norm_factor)
+        # The continuum plus stellar baseline is shared by the total
+        # model and by every individual component below, so it is
+        # evaluated once and the remaining arithmetic is done in place
+        # to avoid a chain of temporary arrays per curve.
+        inv_norm = 1.0 / norm_factor
+        baseline = c + star
+        ax.plot(wl, s * inv_norm)
+        ax.plot(wl, star * inv_norm)
+        ax.plot(wl, baseline * inv_norm)
+        model = f(wl, rest_wl, pp) + baseline
+        model *= inv_norm
+        ax.plot(wl, model)
 
         ax.set_xlabel(r'Wavelength (${\rm \AA}$)')
         ax.set_ylabel(
@@ -1380,7 +1678,8 @@ class Cube:
 
         if len(p) > npars:
             for i in np.arange(0, len(p), npars):
-                modeled_spec = (c + star + f(wl, rest_wl[int(i / npars)], pp[i: i + npars])) / norm_factor
+                modeled_spec = f(wl, rest_wl[int(i / npars)], pp[i: i + npars]) + baseline
+                modeled_spec *= inv_norm
                 ax.plot(wl, modeled_spec, 'k--')
 
         # NOTE: This is only here for backwards compatibility with
@@ -1502,7 +1801,7 @@ class Cube:
         None.
         """
 
-        m = self.flags.astype('bool')
+        m = self.flags.astype(bool, copy=False)
 
         self.data = cubetools.rebin(self.data, xbin, ybin, combine=combine, mask=m)
         self.stellar = cubetools.rebin(self.stellar, xbin, ybin, combine=combine, mask=m)
@@ -1548,20 +1847,14 @@ class Cube:
         if write_fits and outfile is None:
             raise RuntimeError('Output file name not given.')
 
-        gdata = np.zeros_like(self.data)
-        gvar = np.zeros_like(self.noise_cube)
-
-        i = 0
-
-        while i < len(self.wl):
-            tmp_data = cubetools.nan_to_nearest(self.data[i])
-            # noinspection PyTypeChecker
-            tmp_var = cubetools.nan_to_nearest(self.noise_cube[i]) ** 2
-
-            gdata[i] = gaussian_filter(tmp_data, sigma)
-            gvar[i] = np.sqrt(gaussian_filter(tmp_var, sigma))
+        # A single separable 3D convolution with a null sigma along the
+        # wavelength axis smooths every image of the cube in one pass,
+        # instead of setting up one filter call per wavelength slice.
+        tmp_data = cubetools.nan_to_nearest_cube(self.data)
+        tmp_var = cubetools.nan_to_nearest_cube(self.noise_cube) ** 2
 
-            i += 1
+        gdata = gaussian_filter(tmp_data, sigma=(0, sigma, sigma))
+        gvar = np.sqrt(gaussian_filter(tmp_var, sigma=(0, sigma, sigma)))
 
         if write_fits:
             hdulist = fits.open(self.fitsfile)
@@ -1621,20 +1914,22 @@ class Cube:
 
         # Initializing the binned arrays as zeros.
         assert hasattr(self, 'data'), 'Could not access the data attribute of the Cube object.'
+        flag_mask = self.flags.astype(bool, copy=False)
         b_data = ma.zeros(self.data.shape)
-        b_data.mask = self.flags.astype(bool)
+        b_data.mask = flag_mask
 
         assert hasattr(self, 'variance'), 'Could not access the variance attribute of the Cube object.'
         b_variance = ma.zeros(self.variance.shape)
-        b_variance.mask = self.flags.astype(bool)
+        b_variance.mask = flag_mask
 
         assert hasattr(self, 'flags'), 'Could not access the variance attribute of the Cube object.'
         b_flags = np.zeros_like(self.flags, dtype=int)
 
         valid_spaxels = np.ravel(~np.isnan(self.signal) & ~np.isnan(self.noise) & ~self.spatial_mask)
 
-        x = np.ravel(np.indices(np.shape(self.signal))[1])[valid_spaxels]
-        y = np.ravel(np.indices(np.shape(self.signal))[0])[valid_spaxels]
+        yy, xx = self._index_grids()
+        x = xx.ravel()[valid_spaxels]
+        y = yy.ravel()[valid_spaxels]
 
         s, n = deepcopy(self.signal), deepcopy(self.noise)
 
@@ -1649,23 +1944,26 @@ class Cube:
 
         # For every nan in the original cube, fill with nan the binned cubes.
         nan_idx = (Ellipsis,
-                   np.ravel(np.indices(np.shape(self.signal))[0])[~valid_spaxels],
-                   np.ravel(np.indices(np.shape(self.signal))[1])[~valid_spaxels])
+                   yy.ravel()[~valid_spaxels],
+                   xx.ravel()[~valid_spaxels])
         b_data[nan_idx] = np.nan
         b_variance[nan_idx] = np.nan
         b_flags[nan_idx] = 1
 
-        for i in np.arange(bin_num.max() + 1):
-            same_bin = v[:, 2] == i
-            same_bin_coordinates = v[same_bin, :2]
+        # Averages every bin in a single pass over the cube and
+        # scatters the result back to all member spaxels at once,
+        # instead of recomputing the same bin mean for each spaxel.
+        n_bins = bin_num.max() + 1
+        counts = np.bincount(bin_num, minlength=n_bins)
 
-            for k in same_bin_coordinates:
-                binned_idx = (Ellipsis, k[0], k[1])
-                unbinned_idx = (Ellipsis, same_bin_coordinates[:, 0], same_bin_coordinates[:, 1])
+        def bin_average(cube):
+            accumulator = np.zeros((n_bins, cube.shape[0]))
+            np.add.at(accumulator, bin_num, np.asarray(cube[:, y, x], dtype=float).T)
+            return accumulator / counts[:, np.newaxis]
 
-                b_data[binned_idx] = ma.mean(self.data[unbinned_idx], axis=1)
-                b_variance[binned_idx] = ma.mean(self.variance[unbinned_idx], axis=1)
-                b_flags[binned_idx] = (np.mean(self.flags[unbinned_idx], axis=1) >= flag_threshold).astype(int)
+        b_data[:, y, x] = bin_average(self.data)[bin_num].T
+        b_variance[:, y, x] = bin_average(self.variance)[bin_num].T
+        b_flags[:, y, x] = (bin_average(self.flags)[bin_num].T >= flag_threshold).astype(int)
 
         b_data = b_data.data
         b_variance = b_variance.data
@@ -1740,11 +2038,11 @@ class Cube:
 
             assert hasattr(self, 'em_model'), 'This function requires the Cube.em_model attribute to be defined.'
 
-            specs = np.array([])
-            for k, i, j in enumerate(unique_indices):
-                z = self.em_model[0, i, j] / 2.99792458e+5
-                interp_spec = interp1d(self.rest_wavelength / (1. + z), self.data[i, j])
-                specs = np.row_stack([specs, interp_spec(self.rest_wavelength)])
+            ii, jj = np.asarray(unique_indices).T
+            z = self.em_model[0, ii, jj] / 2.99792458e+5
+            specs = np.empty((len(unique_indices), self.rest_wavelength.size))
+            for k, (i, j) in enumerate(unique_indices):
+                specs[k] = np.interp(self.rest_wavelength, self.rest_wavelength / (1. + z[k]), self.data[:, i, j])
 
         else:
             specs = np.row_stack([self.data[:, i, j] for i, j in unique_indices])
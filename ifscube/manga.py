@@ -42,7 +42,7 @@ class cube(datacube.Cube):
         self.binned = False
 
         self._getwl()
-        self._flags()
+        self._set_flags()
         self._spec_indices()
 
         # NOTE: This was probably a leftover and has been
@@ -57,7 +57,7 @@ class cube(datacube.Cube):
 
         hdu.close()
 
-    def _flags(self):
+    def _set_flags(self):
 
         _unused = 0x0001
         no_data = 0x0002
@@ -143,7 +143,7 @@ class IntegratedSpectrum(onedspec.Spectrum):
         if len(args) > 0:
             self._load(*args, **kwargs)
 
-    def _flags(self, flags):
+    def _set_flags(self, flags):
 
         _unused = 0x0001
         no_data = 0x0002
@@ -168,7 +168,7 @@ class IntegratedSpectrum(onedspec.Spectrum):
         self.variance = np.square(t['f_err'])
         self.stellar = t['f_syn']
 
-        self._flags(t['f_flag'])
+        self._set_flags(t['f_flag'])
 
         self.wl = t['l_obs']
         self.restwl = t['l_obs']
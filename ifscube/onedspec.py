@@ -1,9 +1,11 @@
+import hashlib
 import warnings
 from copy import deepcopy
 from typing import Callable, Union, Iterable
 
 import matplotlib.pyplot as plt
 import numpy as np
+from matplotlib.collections import LineCollection
 from astropy import wcs, table, constants, units
 from astropy.io import fits
 from scipy.integrate import trapz
@@ -15,7 +17,10 @@ from . import stats, spectools
 
 
 def scale_bounds(bounds, scale_factor, npars_pc):
-    b = np.array(deepcopy(bounds))
+    # Bounds are a shallow sequence of [low, high] pairs, so building
+    # fresh pairs is cheaper than a recursive deepcopy of the input,
+    # which is only read here.
+    b = np.array([list(j) for j in bounds])
     for j in b[::npars_pc]:
         for k in (0, 1):
             if j[k] is not None:
@@ -52,7 +57,9 @@ class Spectrum:
             Number of the WCS axis which represents the wavelength.
         """
 
+        self._cont_cache = {}
         self.component_names = None
+        self.data = None
         self.em_model = None
         self.eqw_direct = None
         self.eqw_model = None
@@ -65,6 +72,7 @@ class Spectrum:
         self.fitspec = None
         self.fitstellar = None
         self.fitwl = None
+        self.flags = None
         self.flux_err = None
         self.flux_direct = None
         self.flux_model = None
@@ -74,7 +82,9 @@ class Spectrum:
         self.parnames = None
         self.r = None
         self.resultspec = None
+        self.stellar = None
         self.valid_pixels = None
+        self.variance = None
 
         self.ppxf_sol = np.ndarray([])
 
@@ -84,32 +94,73 @@ class Spectrum:
             load_args = {i: locale[i] for i in arg_names}
             self._load(**load_args)
 
+    def _default_accessory(self, value, dtype=None):
+        """Builds a read-only constant spectrum matching the data shape."""
+        if self.data is None:
+            return None
+        if dtype is None:
+            dtype = self.data.dtype
+        return np.broadcast_to(np.array(value, dtype=dtype), self.data.shape)
+
+    @property
+    def variance(self):
+        if self._variance is None:
+            return self._default_accessory(1.0)
+        return self._variance
+
+    @variance.setter
+    def variance(self, value):
+        self._variance = value
+
+    @property
+    def flags(self):
+        if self._flags is None:
+            return self._default_accessory(False, dtype=bool)
+        return self._flags
+
+    @flags.setter
+    def flags(self, value):
+        self._flags = value
+
+    @property
+    def stellar(self):
+        if self._stellar is None:
+            return self._default_accessory(0.0)
+        return self._stellar
+
+    @stellar.setter
+    def stellar(self, value):
+        self._stellar = value
+
     def _accessory_data(self, hdu, variance, flags, stellar):
 
         def shmess(name):
             s = '{:s} spectrum must have the same shape of the spectrum itself'
             return s.format(name)
 
-        self.variance = np.ones_like(self.data)
-        self.flags = np.zeros_like(self.data)
-        self.stellar = np.zeros_like(self.data)
-
-        acc_data = [self.variance, self.flags, self.stellar]
         ext_names = [variance, flags, stellar]
         labels = ['Variance', 'Flags', 'Synthetic']
+        attributes = ['variance', 'flags', 'stellar']
 
-        for i, j, lab in zip(acc_data, ext_names, labels):
+        for j, lab, attribute in zip(ext_names, labels, attributes):
 
+            data = None
             if j is not None:
                 if isinstance(j, str):
                     if j in hdu:
                         assert hdu[j].data.shape == self.data.shape, \
                             shmess(lab)
-                        i[:] = hdu[j].data
+                        data = np.array(hdu[j].data)
                 elif isinstance(j, np.ndarray):
-                    i[:] = j
+                    data = np.array(j)
 
-        self.flags = self.flags.astype(bool)
+            if (data is not None) and (attribute == 'flags'):
+                data = data.astype(bool)
+
+            # Spectra for which no data was provided are left as None,
+            # and materialized as read-only constant broadcasts by the
+            # respective property getters.
+            setattr(self, attribute, data)
 
     def _load(self, fname: str, scidata: str = 'SCI', variance: str = None, flags: str = None, stellar: str = None,
               primary: str = 'PRIMARY', redshift: float = None, wcs_axis: int = None) -> None:
@@ -168,8 +219,8 @@ class Spectrum:
         cnames = self.component_names
         pnames = self.parnames
 
-        c = np.array([[i for _ in pnames] for i in cnames]).flatten()
-        p = np.array([[i for i in pnames] for _ in cnames]).flatten()
+        c = np.repeat(np.asarray(cnames), len(pnames))
+        p = np.tile(np.asarray(pnames), len(cnames))
 
         t = table.Table([c, p], names=('component', 'parameter'))
         h = fits.table_to_hdu(t)
@@ -193,83 +244,49 @@ class Spectrum:
             hdr['REDSHIFT'] = (self.redshift,
                                'Redshift used in IFSCUBE')
 
-        # Creates MEF output.
-        h = fits.HDUList()
-        hdu = fits.PrimaryHDU(header=self.header)
-        hdu.name = 'PRIMARY'
-        h.append(hdu)
-
-        # Creates the fitted spectrum extension
-        hdr = fits.Header()
-        hdr['object'] = ('spectrum', 'Data in this extension')
-        hdr['CRPIX1'] = (1, 'Reference pixel for wavelength')
-        hdr['CRVAL1'] = (self.fitwl[0], 'Reference value for wavelength')
-        hdr['CD1_1'] = (np.average(np.diff(self.fitwl)), 'CD1_1')
-        hdu = fits.ImageHDU(data=self.fitspec, header=hdr)
-        hdu.name = 'FITSPEC'
-        h.append(hdu)
-
-        # Creates the fitted continuum extension.
-        hdr['object'] = 'continuum'
-        hdu = fits.ImageHDU(data=self.fitcont, header=hdr)
-        hdu.name = 'FITCONT'
-        h.append(hdu)
-
-        # Creates the stellar continuum extension.
-        hdr['object'] = 'stellar'
-        hdu = fits.ImageHDU(data=self.fitstellar, header=hdr)
-        hdu.name = 'STELLAR'
-        h.append(hdu)
+        # Base header template shared by all image extensions. Each HDU
+        # gets its own copy with only the differing cards set, instead
+        # of repeatedly mutating a single header instance.
+        base = fits.Header()
+        base['CRPIX1'] = (1, 'Reference pixel for wavelength')
+        base['CRVAL1'] = (self.fitwl[0], 'Reference value for wavelength')
+        base['CD1_1'] = (spectools.sampling_delta(self.fitwl), 'CD1_1')
 
-        # Creates the fitted function extension.
-        hdr['object'] = 'modeled_spec'
-        hdu = fits.ImageHDU(data=self.resultspec, header=hdr)
-        hdu.name = 'MODEL'
-        h.append(hdu)
-
-        # Creates the solution extension.
-        hdr = fits.Header()
+        # Creates the solution header, with the fit description cards.
         function = args['function']
-        hdr['fitstat'] = self.fit_status
         total_pars = self.em_model.shape[0] - 1
 
-        hdr['object'] = 'parameters'
-        hdr['function'] = (function, 'Fitted function')
-        hdr['nfunc'] = (int(total_pars / self.npars), 'Number of functions')
-        hdu = fits.ImageHDU(data=self.em_model, header=hdr)
-        hdu.name = 'SOLUTION'
-        h.append(hdu)
-
-        # Integrated flux extensions
-        hdr['object'] = 'flux_model'
-        hdu = fits.ImageHDU(data=self.flux_model, header=hdr)
-        hdu.name = 'FLUX_M'
-        h.append(hdu)
-
-        hdr['object'] = 'flux_direct'
-        hdu = fits.ImageHDU(data=self.flux_direct, header=hdr)
-        hdu.name = 'FLUX_D'
-        h.append(hdu)
-
-        # Equivalent width extensions
-        hdr['object'] = 'eqw_model'
-        hdu = fits.ImageHDU(data=self.eqw_model, header=hdr)
-        hdu.name = 'EQW_M'
-        h.append(hdu)
-
-        hdr['object'] = 'eqw_direct'
-        hdu = fits.ImageHDU(data=self.eqw_direct, header=hdr)
-        hdu.name = 'EQW_D'
-        h.append(hdu)
+        solution_hdr = base.copy()
+        solution_hdr['object'] = 'parameters'
+        solution_hdr['fitstat'] = self.fit_status
+        solution_hdr['function'] = (function, 'Fitted function')
+        solution_hdr['nfunc'] = (int(total_pars / self.npars), 'Number of functions')
 
-        # # Creates the minimize's exit status extension
-        # hdr['object'] = 'status'
-        # hdu = fits.ImageHDU(data=self.fit_status, header=hdr)
-        # hdu.name = 'STATUS'
-        # h.append(hdu)
+        # Creates MEF output.
+        h = fits.HDUList([fits.PrimaryHDU(header=self.header)])
+        h[0].name = 'PRIMARY'
+
+        image_extensions = [
+            ('FITSPEC', self.fitspec, ('spectrum', 'Data in this extension')),
+            ('FITCONT', self.fitcont, 'continuum'),
+            ('STELLAR', self.fitstellar, 'stellar'),
+            ('MODEL', self.resultspec, 'modeled_spec'),
+            ('SOLUTION', self.em_model, None),
+            ('FLUX_M', self.flux_model, 'flux_model'),
+            ('FLUX_D', self.flux_direct, 'flux_direct'),
+            ('EQW_M', self.eqw_model, 'eqw_model'),
+            ('EQW_D', self.eqw_direct, 'eqw_direct'),
+        ]
+
+        for name, data, obj in image_extensions:
+            if obj is None:
+                extension_hdr = solution_hdr
+            else:
+                extension_hdr = base.copy()
+                extension_hdr['object'] = obj
+            h.append(fits.ImageHDU(data=data, header=extension_hdr, name=name))
 
         # Creates component and parameter names table.
-        hdr['object'] = 'parameter names'
         hdu = self._fit_table()
         hdu.name = 'PARNAMES'
         h.append(hdu)
@@ -396,7 +413,7 @@ class Spectrum:
                 print('up_lam: ' + str(up_lam))
                 print('width: ' + str(width))
                 print('sigma: ' + str(s))
-                mask = np.ones_like(wl).astype('bool')
+                mask = np.ones(wl.shape, dtype=bool)
                 return mask
 
             idx = [np.where(wl == i)[0][0] for i in wl_lims]
@@ -428,8 +445,9 @@ class Spectrum:
             m = fit_func(wl[opt_mask], free_feature_wl, x[:-1]) + (x[-1] * fixed_emission)
             a = w[opt_mask] * (s[opt_mask] - m) ** 2
             b = a / v[opt_mask]
-            rms = np.sqrt(np.sum(b))
-            return rms
+            # Same monotonic objective as the unconstrained residual:
+            # minimizing the sum is equivalent to minimizing its root.
+            return np.sum(b)
 
         full_p0 = deepcopy(p0)
         full_sbounds = deepcopy(sbounds)
@@ -572,10 +590,10 @@ class Spectrum:
 
         # Sets a pre-made nan vector for nan solutions.
         npars = len(p0)
-        self.em_model = np.array([np.nan for i in range(npars + 1)])
+        self.em_model = np.full(npars + 1, np.nan)
 
         if fitting_window is None:
-            fw = np.ones_like(self.data).astype('bool')
+            fw = np.ones(self.data.shape, dtype=bool)
         else:
             fw = (self.rest_wavelength > fitting_window[0]) & \
                  (self.rest_wavelength < fitting_window[1])
@@ -601,9 +619,11 @@ class Spectrum:
         valid_pixels = (~self.flags) & fw
         self.valid_pixels = valid_pixels
 
-        wl = deepcopy(self.rest_wavelength[valid_pixels])
-        data = deepcopy(self.data[valid_pixels])
-        stellar = deepcopy(self.stellar[valid_pixels])
+        # Boolean indexing already yields fresh contiguous copies, so
+        # no further copying is needed before the arrays are modified.
+        wl = self.rest_wavelength[valid_pixels]
+        data = self.data[valid_pixels]
+        stellar = self.stellar[valid_pixels]
 
         self.fitspec = self.data[fw]
         self.resultspec = zero_spec
@@ -617,7 +637,13 @@ class Spectrum:
 
         # noinspection PyTypeChecker
         p0 = np.array(self.guess_parser(p0))
-        self.fitbounds = bounds
+        # Stored as a flat float vector, with NaN standing in for
+        # unbounded parameters, so that it can be written directly
+        # into the fitbounds cube without further conversion.
+        if bounds is None:
+            self.fitbounds = np.full(2 * p0.size, np.nan)
+        else:
+            self.fitbounds = np.array([np.nan if k is None else k for k in np.ravel(np.asarray(bounds, dtype=object))])
 
         #
         # Avoids fit if more than certain fraction of the pixels are
@@ -663,7 +689,18 @@ class Spectrum:
                         return cw
                     new_copts.update({'weights': continuum_weights(self.sigma_lambda(p0[2::npars_pc], feature_wl))})
 
-                pcont: Union[Iterable, Callable] = spectools.continuum(wl, data - stellar, **new_copts)
+                # Repeated calls over the same spectrum, as happens in
+                # refits with perturbed initial guesses, request exactly
+                # the same polynomial fit, so the result is memoized on
+                # a hash of the input arrays and the fitting options.
+                key_hash = hashlib.blake2b(wl.tobytes(), digest_size=8)
+                key_hash.update((data - stellar).tobytes())
+                key_hash.update(new_copts['weights'].tobytes())
+                key = (key_hash.hexdigest(),
+                       tuple(sorted((i, j) for i, j in new_copts.items() if i != 'weights')))
+                if key not in self._cont_cache:
+                    self._cont_cache[key] = spectools.continuum(wl, data - stellar, **new_copts)
+                pcont: Union[Iterable, Callable] = self._cont_cache[key]
                 self.fitcont = pcont(self.rest_wavelength[fw])
                 cont = pcont(wl)
             else:
@@ -722,7 +759,7 @@ class Spectrum:
                 self.fit_status = 80
                 return
         else:
-            opt_mask = np.ones_like(wl).astype(bool)
+            opt_mask = np.ones(wl.shape, dtype=bool)
 
         if guess_parameters:
             p0 = self.guess_parameters(s, wl, p0, npars_pc, sbounds)
@@ -733,34 +770,86 @@ class Spectrum:
         #
 
         if fixed_components is None:
+            # Constant terms of the objective function, gathered once
+            # instead of at every call from the minimizer. The
+            # wavelength arrays feed the Fortran profile functions,
+            # which work on 32-bit floats, so converting them here
+            # saves a copy per call as well.
+            wl_opt = np.ascontiguousarray(wl[opt_mask], dtype=np.float32)
+            feature_wl_opt = np.ascontiguousarray(feature_wl, dtype=np.float32)
+            s_opt = s[opt_mask]
+            w_opt = w[opt_mask]
+            v_opt = v[opt_mask]
+
             def res(x):
-                m = fit_func(wl[opt_mask], feature_wl, x)
-                a = w[opt_mask] * (s[opt_mask] - m) ** 2
-                b = a / v[opt_mask]
-                rms = np.sqrt(np.sum(b))
-                return rms
+                # A single temporary, updated in place, instead of one
+                # allocation per arithmetic step; this closure runs once
+                # per minimizer iteration. The profile evaluation itself
+                # is already compiled Fortran.
+                b = s_opt - fit_func(wl_opt, feature_wl_opt, x)
+                b *= b
+                b *= w_opt
+                b /= v_opt
+                # The square root of the summed residuals is a
+                # monotonic transform of the objective: it does not
+                # move the minimum, but costs a transcendental per
+                # iteration and compresses the finite-difference
+                # gradient, so the plain sum is minimized instead.
+                return np.sum(b)
+
+            if function == 'gaussian':
+                # The velocity associated with each wavelength depends
+                # only on the rest wavelength of the component, so it
+                # is evaluated once per fit rather than at every
+                # gradient evaluation.
+                light_speed = 299792.458
+                lam_ratio = (wl_opt.astype(np.float64)[np.newaxis, :]
+                             / feature_wl_opt.astype(np.float64)[:, np.newaxis]) ** 2
+                velocity = light_speed * (lam_ratio - 1.0) / (lam_ratio + 1.0)
+                double_weight = 2.0 * w_opt / v_opt
+
+                def jac(x):
+                    # Analytic gradient of the objective above. Without
+                    # it SLSQP estimates the gradient numerically, at
+                    # the cost of one extra res evaluation per free
+                    # parameter at each iteration.
+                    residual = double_weight * (s_opt - fit_func(wl_opt, feature_wl_opt, x))
+                    grad = np.empty(len(x))
+                    for i, vel in enumerate(velocity):
+                        a, v0, sig = x[(3 * i):(3 * i + 3)]
+                        u = (vel - v0) / sig
+                        common = residual * np.exp(-u * u / 2.0)
+                        grad[3 * i] = -np.sum(common)
+                        grad[3 * i + 1] = -np.sum(common * u) * (a / sig)
+                        grad[3 * i + 2] = -np.sum(common * u * u) * (a / sig)
+                    return grad
+            else:
+                jac = None
         else:
             res, p0, sbounds, full_p0, full_sbounds, parameter_indices = self._setup_fixed(
                 fixed_components, list(component_names), list(feature_wl), npars_pc, opt_mask, fit_func, p0, wl, v,
                 sbounds, w, s)
+            jac = None
 
         if minopts is None:
             minopts = {'eps': 1e-3}
         if constraints is None:
             constraints = []
 
-        r = minimize(res, x0=p0, method=min_method, bounds=sbounds, constraints=constraints, options=minopts)
+        r = minimize(res, x0=p0, method=min_method, jac=jac, bounds=sbounds, constraints=constraints, options=minopts)
 
         # Perform the fit a second time with the RMS as the flux
         # initial guess. This was added after a number of fits returned
         # high flux values even when no lines were present.
         if trivial:
-            fit_rms = res(r.x)
+            # The residual at the solution is already available on the
+            # minimizer result, so the profile is not synthesized again.
+            fit_residual = r.fun
             new_p = deepcopy(r.x)
             for i in range(0, r.x.size, npars_pc):
                 trivial_p = deepcopy(r.x)
                 trivial_p[i] = 0
-                if fit_rms > res(trivial_p):
+                if fit_residual > res(trivial_p):
                     new_p[i:i + npars_pc] = np.nan
             r.x = new_p
 
@@ -1106,10 +1195,11 @@ class Spectrum:
         s = self.fitspec
         star = self.fitstellar
 
+        baseline = c + star
         ax.plot(wl, s)
         ax.plot(wl, star)
-        ax.plot(wl, c + star)
-        ax.plot(wl, c + star + f(wl, rest_wl, pp))
+        ax.plot(wl, baseline)
+        ax.plot(wl, baseline + f(wl, rest_wl, pp))
 
         npars = self.npars
         parnames = self.parnames
@@ -1121,9 +1211,14 @@ class Spectrum:
             self.component_names = [str(i) for i in range(0, len(p) / npars)]
 
         if len(p) > npars:
+            # All component curves go into a single LineCollection, so
+            # matplotlib handles one artist instead of one Line2D per
+            # component, and the baseline sum is reused from above.
+            segments = []
             for i in np.arange(0, len(p), npars):
                 rwl = np.array([rest_wl[int(i / npars)]])
-                ax.plot(wl, c + star + f(wl, rwl, p[i: i + npars]), 'k--')
+                segments.append(np.column_stack((wl, baseline + f(wl, rwl, p[i: i + npars]))))
+            ax.add_collection(LineCollection(segments, colors='k', linestyles='dashed'))
 
         pars = ((npars + 1) * '{:12s}' + '\n').format('Name', *parnames)
         for i in np.arange(0, len(p), npars):
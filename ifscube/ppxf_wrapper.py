@@ -1,6 +1,8 @@
 # This module is a wrapper for the ppxf package available in PyPI
 import copy
 import glob
+import threading
+from concurrent import futures
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -99,18 +101,18 @@ def spectrum_kinematics(spectrum, fitting_window=None, **kwargs):
         output.header_data = copy.deepcopy(spectrum.header_data)
         output.header_data['CRPIX3'] = (1, 'Reference pixel for wavelength')
         output.header_data['CRVAL3'] = (spectrum.rest_wavelength[fw][0], 'Reference value for wavelength')
-        output.header_data['CD3_3'] = (np.mean(np.diff(spectrum.rest_wavelength)), 'CD3_3')
+        output.header_data['CD3_3'] = (spectools.sampling_delta(spectrum.rest_wavelength), 'CD3_3')
     else:
         w = wcs.WCS(naxis=1)
         w.wcs.crpix = np.array([1.])
         w.wcs.crval = np.array([spectrum.rest_wavelength[fw][0]])
-        w.wcs.cdelt = np.array([np.mean(np.diff(spectrum.rest_wavelength))])
+        w.wcs.cdelt = np.array([spectools.sampling_delta(spectrum.rest_wavelength)])
         output.header_data = w.to_header()
 
     return output
 
 
-def cube_kinematics(cube, fitting_window, individual_spec=None, verbose=False, **kwargs):
+def cube_kinematics(cube, fitting_window, individual_spec=None, verbose=False, dtype='float32', **kwargs):
     """
     Executes pPXF fitting of the stellar spectrum over the whole
     data cube.
@@ -125,6 +127,11 @@ def cube_kinematics(cube, fitting_window, individual_spec=None, verbose=False, *
         (x, y) coordinates of the individual spaxel to be fit.
     verbose : bool
         Prints progress messages.
+    dtype : str
+        Data type of the output solution, spectrum and model cubes.
+        Single precision halves their memory footprint and is more
+        than the fit results warrant; pass 'float64' for the legacy
+        behavior.
     **kwargs
         Arguments passed directly to ppxf_wrapper.Fit.fit.
 
@@ -144,10 +151,38 @@ def cube_kinematics(cube, fitting_window, individual_spec=None, verbose=False, *
     """
 
     vor = None
+    spaxel_bin = None
+    bin_members = None
     if cube.binned:
         vor = cube.voronoi_tab
-        xy = np.column_stack(
-            [vor[coords][np.unique(vor['binNum'], return_index=True)[1]] for coords in ['ycoords', 'xcoords']])
+        # Plain integer ndarray copies of the table columns, read once,
+        # so everything below runs on raw NumPy instead of astropy
+        # Column wrappers.
+        vor_y = np.asarray(vor['ycoords'], dtype=np.int32)
+        vor_x = np.asarray(vor['xcoords'], dtype=np.int32)
+        vor_bn = np.asarray(vor['binNum'], dtype=np.int32)
+        # A single sort of the bin column locates the first member of
+        # every bin, instead of one np.unique per coordinate column.
+        first_bin_index = np.unique(vor_bn, return_index=True)[1]
+        # Filling a preallocated two-column array writes each
+        # coordinate slice straight into place, instead of the
+        # temporaries plus stacking copy of np.column_stack.
+        xy = np.empty((first_bin_index.size, 2), dtype=np.int32)
+        xy[:, 0] = vor_y[first_bin_index]
+        xy[:, 1] = vor_x[first_bin_index]
+        # Maps each spaxel to its bin and each bin to the coordinates
+        # of all its members, replacing two boolean scans of the full
+        # Voronoi table for every fitted spectrum.
+        spaxel_bin = {}
+        bin_members = {}
+        for y_bin, x_bin, num in zip(vor_y, vor_x, vor_bn):
+            spaxel_bin[(y_bin, x_bin)] = num
+            bin_members.setdefault(num, []).append((y_bin, x_bin))
+        # Member coordinates become index arrays, so the broadcast of a
+        # fitted solution over its bin is a single fancy-indexed store.
+        for num, members in bin_members.items():
+            member_array = np.asarray(members, dtype=np.int32)
+            bin_members[num] = (member_array[:, 0], member_array[:, 1])
     else:
         xy = cube.spec_indices
 
@@ -159,8 +194,10 @@ def cube_kinematics(cube, fitting_window, individual_spec=None, verbose=False, *
     fw = (cube.rest_wavelength >= fitting_window[0]) & (cube.rest_wavelength <= fitting_window[1])
     wavelength = cube.rest_wavelength[fw]
 
-    sol = np.zeros((4, np.shape(cube.data)[1], np.shape(cube.data)[2]), dtype='float64')
-    data = cube.data[fw]
+    sol = np.zeros((4, np.shape(cube.data)[1], np.shape(cube.data)[2]), dtype=dtype)
+    # Boolean indexing already copies, so the cast is free when the
+    # input cube is single precision.
+    data = cube.data[fw].astype(dtype, copy=False)
     model = np.zeros_like(data)
     noise = np.sqrt(cube.variance[fw])
     flags = cube.flags[fw]
@@ -173,7 +210,8 @@ def cube_kinematics(cube, fitting_window, individual_spec=None, verbose=False, *
 
     if individual_spec is None:
         summed_flags = flags.sum(axis=0)
-        spatial_mask = np.array([summed_flags[i[0], i[1]] / len(wavelength) > 0.2 for i in xy])
+        xy = np.asarray(xy)
+        spatial_mask = summed_flags[xy[:, 0], xy[:, 1]] / len(wavelength) > 0.2
         xy = xy[~spatial_mask]
 
     if verbose:
@@ -183,13 +221,26 @@ def cube_kinematics(cube, fitting_window, individual_spec=None, verbose=False, *
         # noinspection PyTypeChecker
         iterator = xy
 
-    for h in iterator:
+    # Each spaxel is fitted independently, so the fits are dispatched
+    # to a thread pool. Fit instances keep per-fit state, so every
+    # worker thread gets its own copy of the template fit, which also
+    # avoids re-reading the model files from disk. The process pool
+    # alternative would require pickling the kwargs, which may carry
+    # arbitrary objects for ppxf. Threads also read the data, noise and
+    # flag cubes directly from the shared address space, so no spectrum
+    # is ever copied or serialized on its way to a worker.
+    thread_data = threading.local()
+
+    def fit_spaxel(h):
         i, j = h
 
-        pop_it_later = False
+        local_fit = getattr(thread_data, 'fit', None)
+        if local_fit is None:
+            local_fit = thread_data.fit = copy.deepcopy(fit)
+
+        local_kwargs = kwargs
         if ('noise' not in kwargs) and ~np.all(noise[:, i, j] == 1.0):
-            kwargs['noise'] = noise[:, i, j]
-            pop_it_later = True
+            local_kwargs = dict(kwargs, noise=noise[:, i, j])
 
         if (mask is not None) and ((cube.flags is not None) and np.any(cube.flags[:, i, j])):
             m = mask + spectools.flags_to_mask(wavelength, flags[:, i, j])
@@ -200,36 +251,50 @@ def cube_kinematics(cube, fitting_window, individual_spec=None, verbose=False, *
         else:
             m = None
 
-        pp = fit.fit(wavelength, data[:, i, j], mask=m, **kwargs)
+        pp = local_fit.fit(wavelength, data[:, i, j], mask=m, **local_kwargs)
         if len(pp.sol) < 4:
             pp.sol = np.concatenate([pp.sol, (4 - len(pp.sol)) * [0.,]])
 
-        if pop_it_later:
-            kwargs.pop('noise')
-
-        if vor is not None:
+        galaxy = np.interp(wavelength, local_fit.obs_wavelength, pp.galaxy * local_fit.normalization_factor)
+        bestfit = np.interp(wavelength, local_fit.obs_wavelength, pp.bestfit * local_fit.normalization_factor)
+        return pp.sol, galaxy, bestfit
 
-            bin_num = vor[(vor['xcoords'] == j) & (vor['ycoords'] == i)]['binNum']
-            same_bin_num = vor['binNum'] == bin_num
-            same_bin_x = vor['xcoords'][same_bin_num]
-            same_bin_y = vor['ycoords'][same_bin_num]
+    with futures.ThreadPoolExecutor() as executor:
+        for h, (pp_sol, galaxy, bestfit) in zip(iterator, executor.map(fit_spaxel, xy)):
+            i, j = h
 
-            for l, m in np.column_stack([same_bin_y, same_bin_x]):
-                sol[:, l, m] = pp.sol
-                data[:, l, m] = np.interp(wavelength, fit.obs_wavelength, pp.galaxy * fit.normalization_factor)
-                model[:, l, m] = np.interp(wavelength, fit.obs_wavelength, pp.bestfit * fit.normalization_factor)
+            if vor is not None:
 
-        else:
-            sol[:, i, j] = pp.sol
-            data[:, i, j] = np.interp(wavelength, fit.obs_wavelength, pp.galaxy * fit.normalization_factor)
-            model[:, i, j] = np.interp(wavelength, fit.obs_wavelength, pp.bestfit * fit.normalization_factor)
-
-    output = copy.deepcopy(cube)
+                rows, columns = bin_members[spaxel_bin[(i, j)]]
+                sol[:, rows, columns] = pp_sol[:, np.newaxis]
+                data[:, rows, columns] = galaxy[:, np.newaxis]
+                model[:, rows, columns] = bestfit[:, np.newaxis]
 
+            else:
+                sol[:, i, j] = pp_sol
+                data[:, i, j] = galaxy
+                model[:, i, j] = bestfit
+
+    # The spectral arrays of the input are replaced on the output just
+    # below, so they are detached before the deepcopy instead of being
+    # duplicated only to be thrown away; for a large cube that saves
+    # several full-cube allocations. fit_func joins them because the
+    # compiled profile functions stored by linefit cannot be deep
+    # copied, and a stale reference is of no use on the output anyway.
+    replaced = ('data', '_stellar', '_flags', '_variance', 'ppxf_sol', 'fit_func')
+    detached = {key: cube.__dict__.pop(key) for key in replaced if key in cube.__dict__}
+    try:
+        output = copy.deepcopy(cube)
+    finally:
+        cube.__dict__.update(detached)
+
+    output.fit_func = None
     output.data = data
     output.stellar = model
     output.flags = flags
-    output.variance = np.square(noise)
+    # The square is written into the existing buffer: noise is local to
+    # this call and not used afterwards.
+    output.variance = np.multiply(noise, noise, out=noise)
     output.ppxf_sol = sol
     output.rest_wavelength = wavelength
 
@@ -207,6 +207,18 @@ def closest(arr, value):
     return idx
 
 
+def sampling_delta(x):
+    """
+    Returns the average sampling step of the coordinates x.
+
+    Since the sum of the differences between successive elements
+    telescopes, this equals the mean of np.diff(x) without allocating
+    the intermediate array.
+    """
+
+    return (x[-1] - x[0]) / (len(x) - 1)
+
+
 def get_wl(image, dimension=0, hdrext=0, dataext=0, dwlkey='CD1_1', wl0key='CRVAL1', pix0key='CRPIX1'):
     """
     Obtains the wavelenght coordinates from the header keywords of the